@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# Size of the markdown written for the benchmark corpora with and without
+# compact=True, for every format. Rendered with recover=True, some corpora
+# use nodes that not every format allows and the output is the same.
+from __future__ import print_function
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import markdown_tags as m
+from memory_per_node import make_reply
+from run_benchmarks import mixed_replies, nested_lists, quote_bodies
+
+corpora = [("bot_replies", lambda: m.MD(*[block for i in range(500) for block in make_reply(i).contents])),
+           ("mixed_replies", lambda: mixed_replies(1)),
+           ("nested_lists_8", lambda: nested_lists(1)),
+           ("quote_bodies", lambda: quote_bodies(1))]
+
+
+def main():
+    print("%-16s %-12s %12s %12s %8s" % ("corpus", "format", "default", "compact", "saved"))
+    for (name, build) in corpora:
+        tags = build()
+        for format_md in m.MarkdownFormats:
+            default = len(tags.tags_to_bytes(True, format_md))
+            compact = len(tags.tags_to_bytes(True, format_md, compact=True))
+            print("%-16s %-12s %12d %12d %7.1f%%" % (name, format_md.value, default, compact,
+                                                     (1 - float(compact) / default) * 100))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
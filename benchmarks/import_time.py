@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# Cold import time of markdown_tags in fresh interpreters, taken from
+# -X importtime so interpreter startup isn't counted. Bytecode is written by
+# a first unmeasured run, as it would be for an installed package. Exits with
+# 1 when the best run is over the budget or the import pulled in lazily
+# loaded modules.
+#
+#   python benchmarks/import_time.py --budget-ms 15
+from __future__ import print_function
+import argparse
+import os
+import subprocess
+import sys
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+lazy_modules = ["markdown_tags.markdown_parser", "markdown_tags.reddit_specific", "html"]
+
+env = dict(os.environ)
+env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+check_lazy = ("import sys, markdown_tags; "
+              "print(' '.join(m for m in %r if m in sys.modules))" % (lazy_modules,))
+
+
+def import_microseconds():
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import markdown_tags"],
+                            cwd=root, env=env, stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True).stderr
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == "markdown_tags":
+            return int(fields[1])
+    raise RuntimeError("markdown_tags missing from -X importtime output")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the cold import time of markdown_tags.")
+    parser.add_argument("--budget-ms", type=float, default=15.0)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    import_microseconds()
+    best = min(import_microseconds() for i in range(args.repeat)) / 1000.0
+    loaded = subprocess.run([sys.executable, "-c", check_lazy], cwd=root, env=env, stdout=subprocess.PIPE,
+                            universal_newlines=True, check=True).stdout.split()
+    print("import markdown_tags: %.2f ms (budget %.2f ms)" % (best, args.budget_ms))
+    failed = False
+    if best > args.budget_ms:
+        print("over budget")
+        failed = True
+    if loaded:
+        print("imported eagerly: " + ", ".join(loaded))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
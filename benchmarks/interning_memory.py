@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# Memory held by a corpus of bot replies built as usual and built through an
+# InternTable, which shares the subtrees and strings the replies have in
+# common.
+from __future__ import print_function
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import markdown_tags as m
+import markdown_tags.reddit_specific as rmd
+from memory_per_node import REPLIES
+
+rules = ["Be civil", "No spoilers in titles", "Tag your posts", "No reposts within a month",
+         "Link to the source", "No self promotion", "English titles", "No memes on weekdays"]
+
+
+def make_reply(i):
+    # A moderation bot's reply: the user and thread change, the removal
+    # reason is one of a few and the rules and footer are always the same.
+    return m.MD(m.Paragraph("Hello ", m.Bold("user_" + str(i)), ", your post in ",
+                            m.Link("http://example.com/r/thread_" + str(i % 50), "this thread"),
+                            " was removed."),
+                m.Header(3, "Reason"),
+                m.Paragraph(m.Italic(rules[i % 3])),
+                m.OrderedList.with_title("Please read the rules:", *rules),
+                m.HorizontalRuleLine(),
+                m.Paragraph(rmd.Superscript("I am a bot"), " ",
+                            rmd.Superscript(m.Link("http://example.com/r/modmail", "contact the moderators"))))
+
+
+def measure(build, replies=REPLIES):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    corpus = [build(i) for i in range(replies)]
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return (allocated, corpus)
+
+
+if __name__ == "__main__":
+    table = m.InternTable()
+    (plain, corpus) = measure(make_reply)
+    del corpus
+    # The table is part of what interning costs, so it is counted too.
+    (shared, corpus) = measure(lambda i: table.intern(make_reply(i)))
+    print("plain bytes per reply:    %.1f" % (float(plain) / REPLIES))
+    print("interned bytes per reply: %.1f" % (float(shared) / REPLIES))
+    print("interned nodes:           %d" % len(table))
+    print("saved:                    %.0f%%" % ((1 - float(shared) / plain) * 100))
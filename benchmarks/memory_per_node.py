@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# Bytes allocated per tree node for a corpus of prepared bot replies, as built
+# and after one checked render of every reply, which leaves validation results
+# on the nodes.
+from __future__ import print_function
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import markdown_tags as m
+import markdown_tags.reddit_specific as rmd
+
+
+def make_reply(i):
+    return m.MD(m.Header(3, "Summary for post #", str(i)),
+                m.Paragraph("Hello ", m.Bold("user_" + str(i)), ", here is the ",
+                            m.Link("http://example.com/r/" + str(i), "thread " + str(i)), "."),
+                m.UnorderedList(*["item %d of reply %d" % (j, i) for j in range(10)]),
+                m.HorizontalRuleLine(),
+                m.Paragraph(rmd.Superscript("I am a bot"), " ", rmd.Strikethrough("beep")))
+
+
+def count_nodes(obj):
+    count = 0
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        count += 1
+        if isinstance(node, m.MarkdownFormattingObject) and isinstance(node.contents, tuple):
+            stack.extend(node.contents)
+    return count
+
+
+REPLIES = 2000
+
+
+def measure(replies=REPLIES, validated=False):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    corpus = [make_reply(i) for i in range(replies)]
+    if validated:
+        for reply in corpus:
+            reply.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    nodes = sum(count_nodes(r) for r in corpus)
+    return (allocated, nodes)
+
+
+if __name__ == "__main__":
+    for validated in (False, True):
+        (allocated, nodes) = measure(validated=validated)
+        print("validated" if validated else "built")
+        print("  nodes:           %d" % nodes)
+        print("  bytes:           %d" % allocated)
+        print("  bytes per node:  %.1f" % (float(allocated) / nodes))
+        print("  bytes per reply: %.1f" % (float(allocated) / REPLIES))
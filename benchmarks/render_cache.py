@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# Time to render a batch of 20 block bot replies with and without a
+# RenderCache. 15 blocks of every reply are the same frozen boilerplate, the
+# other 5 are built for the reply.
+from __future__ import print_function
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import markdown_tags as m
+import markdown_tags.reddit_specific as rmd
+
+REPLIES = 500
+
+boilerplate = [m.Paragraph("Rule ", str(i), ": ", m.Bold("be civil"), ", see the ", rmd.reddiquette_link, " and ",
+                           m.Link("http://example.com/r/wiki/rules_" + str(i), "rule " + str(i)), ".").freeze()
+               for i in range(13)]
+boilerplate.append(m.HorizontalRuleLine())
+boilerplate.append(m.Paragraph(rmd.Superscript("I am a bot"), " ",
+                               rmd.Superscript(m.Link("http://example.com/r/modmail", "contact the moderators")))
+                   .freeze())
+
+
+def make_reply(i):
+    return m.MD(m.Header(3, "Summary for post #", str(i)),
+                m.Paragraph("Hello ", m.Bold("user_" + str(i)), ", here is the ",
+                            m.Link("http://example.com/r/" + str(i), "thread " + str(i)), "."),
+                m.UnorderedList(*["item %d of reply %d" % (j, i) for j in range(5)]),
+                m.Paragraph("Score ", str(i * 7), " after ", str(i % 24), " hours."),
+                m.BlockQuote(m.Paragraph("quoted from reply ", str(i))),
+                *boilerplate)
+
+
+def render_all(replies, cache):
+    return sum(len(r.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit, cache=cache))
+               for r in replies)
+
+
+def measure(cache_factory, repeat=5):
+    # Replies are built anew for every repetition, like a bot's replies are.
+    best = None
+    for repetition in range(repeat):
+        replies = [make_reply(i) for i in range(REPLIES)]
+        cache = cache_factory()
+        gc.collect()
+        start = time.perf_counter()
+        render_all(replies, cache)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, cache)
+
+
+if __name__ == "__main__":
+    # The boilerplate's own validation is kept on it, warm it up for both.
+    render_all([make_reply(0)], None)
+    plain = measure(lambda: None)[0]
+    (cached, cache) = measure(m.RenderCache)
+    print("without cache: %.1f ms" % (plain * 1000))
+    print("with cache:    %.1f ms" % (cached * 1000))
+    print("hits/misses:   %d/%d" % (cache.hits, cache.misses))
+    print("saved:         %.0f%%" % ((1 - cached / plain) * 100))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# Offline benchmarks for rendering, validation and escaping on wide, deep and
+# mixed trees. Compares against a saved baseline and exits with 1 when a case
+# got slower than the threshold allows.
+#
+#   python benchmarks/run_benchmarks.py --save-baseline
+#   python benchmarks/run_benchmarks.py --threshold 0.2
+from __future__ import print_function
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import markdown_tags as m
+import markdown_tags.reddit_specific as rmd
+
+default_baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+escape_heavy_text = "user_name [link](http://example.com/a_b) *not bold* #1 + 2 - 3. {x}! `code` \\ "
+
+
+def paragraph_flood(scale):
+    return m.MD(*[m.Paragraph("Paragraph ", m.Bold(str(i)), " with some ", m.Italic("text"), ".")
+                  for i in range(20000 * scale)])
+
+
+def nested_lists(scale, depth=8, fan=3):
+    def level(d):
+        if d == depth:
+            return "leaf item"
+        list_class = m.UnorderedList if d % 2 else m.OrderedList
+        return list_class.with_title("Level " + str(d), *[level(d + 1) for i in range(fan)])
+    return m.MD(*[level(0) for i in range(scale)])
+
+
+def quote_bodies(scale):
+    body = "\n".join("Quoted line %d of a long comment body" % i for i in range(200))
+    return m.MD(*[m.BlockQuote(m.Paragraph(body), m.UnorderedList("reply a", m.BlockQuote("nested\nquote")))
+                  for i in range(1000 * scale)])
+
+
+def mixed_replies(scale):
+    return m.MD(*[block
+                  for i in range(2000 * scale)
+                  for block in (m.Header(3, "Post ", str(i)),
+                                m.Paragraph("by ", m.Bold("user_" + str(i)), " ", rmd.Superscript("bot"),
+                                            " ", m.Link("http://example.com/" + str(i), "link")),
+                                m.OrderedList(*["item %d" % j for j in range(5)]),
+                                m.HorizontalRuleLine())])
+
+
+def escape_texts(scale):
+    return [escape_heavy_text * (1 + i % 8) for i in range(20000 * scale)]
+
+
+trees = [("paragraph_flood", paragraph_flood),
+         ("nested_lists_8", nested_lists),
+         ("quote_bodies", quote_bodies),
+         ("mixed_replies", mixed_replies)]
+
+
+def render(recover):
+    def run(tags):
+        return len(tags.tags_to_markdown(recover=recover, format_md=m.MarkdownFormats.reddit))
+    return run
+
+
+def check(tags):
+    tags._check_recursive(m.markdown_tags._MDTagsContext(recover=False, format_md=m.MarkdownFormats.reddit))
+    return 0
+
+
+def escape_each(texts):
+    return sum(len(m.escape(t)) for t in texts)
+
+
+def escape_batch(texts):
+    return sum(len(t) for t in m.escape_many(texts))
+
+
+def cases():
+    for (name, build) in trees:
+        yield (name + ".render_recover", build, render(True))
+        yield (name + ".render_checked", build, render(False))
+        yield (name + ".check_recursive", build, check)
+    yield ("escape", escape_texts, escape_each)
+    yield ("escape_many", escape_texts, escape_batch)
+
+
+def measure(build, run, scale, repeat):
+    # Every repetition gets a freshly built input, validation results are
+    # remembered on the nodes and would make later runs look free.
+    best = None
+    for i in range(repeat):
+        data = build(scale)
+        gc.collect()
+        start = time.perf_counter()
+        output_size = run(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    data = build(scale)
+    gc.collect()
+    tracemalloc.start()
+    run(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": best, "output_chars": output_size, "peak_bytes": peak}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rendering, validation and escaping.")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=default_baseline_path)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown against the baseline, 0.25 is 25%%")
+    parser.add_argument("--filter", default="", help="only run cases containing this string")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    print("%-34s %10s %14s %12s %10s" % ("case", "ms", "chars/s", "peak KiB", "vs base"))
+    for (name, build, run) in cases():
+        if args.filter not in name:
+            continue
+        result = results[name] = measure(build, run, args.scale, args.repeat)
+        throughput = result["output_chars"] / result["seconds"] if result["output_chars"] else 0
+        change = ""
+        if name in baseline:
+            ratio = result["seconds"] / baseline[name]["seconds"]
+            change = "%+.0f%%" % ((ratio - 1) * 100)
+            if ratio > 1 + args.threshold:
+                regressions.append(name)
+                change += " !"
+        print("%-34s %10.1f %14.0f %12.0f %10s" % (name, result["seconds"] * 1000, throughput,
+                                                   result["peak_bytes"] / 1024.0, change))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("saved baseline to " + args.baseline)
+    if regressions:
+        print("regressions beyond %.0f%%: %s" % (args.threshold * 100, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
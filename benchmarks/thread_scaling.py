@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# Renders one shared set of frozen replies with render_many(threads=True) at
+# growing thread counts. On a free-threaded build (python3.13t and later,
+# run with -X gil=0) the speedup should follow the core count, with the GIL
+# it stays near 1.
+#
+#   python3.13t -X gil=0 benchmarks/thread_scaling.py --max-threads 8
+from __future__ import print_function
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import markdown_tags as m
+from run_benchmarks import mixed_replies
+
+
+def best_time(trees, formats, threads, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        m.render_many(trees, formats, recover=False, workers=threads, threads=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure thread pool rendering of frozen trees.")
+    parser.add_argument("--max-threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--trees", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print("GIL enabled: %s, cpus: %s" % (gil, os.cpu_count()))
+    # Small documents, as a bot would reply with, all frozen once.
+    trees = [m.MD(*mixed_replies(1).contents[i * 40:(i + 1) * 40]).freeze() for i in range(args.trees)]
+    formats = [m.MarkdownFormats.basic, m.MarkdownFormats.reddit, m.MarkdownFormats.new_reddit]
+    single = best_time(trees, formats, 1, args.repeat)
+    threads = 1
+    while threads <= args.max_threads:
+        elapsed = best_time(trees, formats, threads, args.repeat)
+        print("%3d threads %10.1f ms  speedup %.2f" % (threads, elapsed * 1000, single / elapsed))
+        threads *= 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,32 @@
-import os.path
-
-from markdown_tags import *
+from .markdown_tags import *
+from ._version import __version__
 
 
 __author__ = "Roman A. Taycher"
 __copyright__ = "Copyright 2014, Roman A. Taycher"
 __credits__ = ["Roman A. Taycher"]
 __license__ = "MIT"
-__version__ = open(os.path.join(os.path.dirname(__file__), "VERSION")).read().strip()
 __maintainer__ = "Roman A. Taycher"
 __email__ = "rtaycher1987@gmail.com"
+
+
+# The parser, template bundles and reddit_specific are only imported when
+# first used.
+_lazy_attributes = {"parse": (".markdown_parser", "parse"),
+                    "iter_parse": (".markdown_parser", "iter_parse"),
+                    "TemplateBundle": (".template_bundle", "TemplateBundle"),
+                    "write_template_bundle": (".template_bundle", "write_template_bundle"),
+                    "reddit_specific": (".reddit_specific", None)}
+
+
+def __getattr__(name):
+    try:
+        (module_name, attribute) = _lazy_attributes[name]
+    except KeyError:
+        raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+    import importlib
+    value = importlib.import_module(module_name, __name__)
+    if attribute is not None:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    return value
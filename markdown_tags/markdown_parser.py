@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+#
+import re
+
+from .markdown_tags import (MD, Blocks, BlockQuote, Bold, Code, Escaped, Header, HorizontalRuleLine, Image,
+                            Italic, Link, MarkdownFormats, MarkdownFormattingObject, OrderedList, Paragraph,
+                            UnorderedList, _List, _escaped_characters)
+
+# The patterns match fixed strings or a bounded prefix of a line, none of
+# them can backtrack.
+_inline_token = re.compile(r"\\.|\*\*\*|\*\*|\*|~~|\^\(|\^|!\[|\[|\]\(|\]|\(|\)")
+_list_marker = re.compile(r" {0,3}([+*-]|\d{1,9}\.)( +|$)")
+_whitespace = re.compile(r"\s")
+_escapable = frozenset(_escaped_characters + list("~^>|"))
+
+
+def parse(source, format_md):
+    # Builds an MD tree from markdown text, source is a string or an iterable
+    # of lines such as an open file.
+    return MD(*iter_parse(source, format_md))
+
+
+def iter_parse(source, format_md):
+    # Yields the top level blocks of source one at a time, each as soon as the
+    # line after it has been read.
+    if isinstance(source, str):
+        lines = source.split("\n")
+    else:
+        lines = (line.rstrip("\n") for line in source)
+    return _iter_blocks((_expand_indent(line.rstrip("\r")) for line in lines), _InlineParser(format_md))
+
+
+def _expand_indent(line):
+    if line[:1] not in ("\t", " "):
+        return line
+    text = line.lstrip(" \t")
+    indent = line[:len(line) - len(text)]
+    if "\t" in indent:
+        return indent.expandtabs(4) + text
+    return line
+
+
+def _indent(line):
+    return len(line) - len(line.lstrip(" "))
+
+
+def _is_rule(line):
+    stripped = line.replace(" ", "")
+    return (len(stripped) >= 3 and stripped[0] in "-*_" and stripped == stripped[0] * len(stripped)
+            and _indent(line) < 4)
+
+
+def _starts_block(line):
+    # Lines that end a paragraph without a blank line in between.
+    stripped = line.lstrip(" ")
+    return _indent(line) < 4 and (stripped[:1] in ("#", ">") or _is_rule(line) or
+                                  _list_marker.match(line) is not None)
+
+
+class _Lines(object):
+    # An iterator over lines that can take one line back.
+    __slots__ = ("_lines", "_pending")
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._pending = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._pending:
+            return self._pending.pop()
+        return next(self._lines)
+
+    def push(self, line):
+        self._pending.append(line)
+
+
+def _iter_blocks(lines, inline):
+    lines = _Lines(lines)
+    while True:
+        block = _run(_next_block(lines, inline), inline)
+        if block is None:
+            return
+        yield block
+
+
+def _run(task, inline):
+    # Quotes and list items are made of blocks parsed from their own lines.
+    # A parsing task yields those lines and is sent back their blocks, the
+    # tasks run one after another on this stack instead of by recursion, so
+    # nesting depth isn't limited by the recursion limit.
+    stack = [task]
+    value = None
+    while True:
+        try:
+            request = stack[-1].send(value)
+        except StopIteration as done:
+            stack.pop()
+            if not stack:
+                return done.value
+            value = done.value
+            continue
+        stack.append(_all_blocks(request, inline))
+        value = None
+
+
+def _all_blocks(lines, inline):
+    lines = _Lines(lines)
+    blocks = []
+    while True:
+        block = yield from _next_block(lines, inline)
+        if block is None:
+            return blocks
+        blocks.append(block)
+
+
+def _next_block(lines, inline):
+    # A task returning the next block from lines, or None after the last.
+    for line in lines:
+        if not line.strip():
+            continue
+        stripped = line.lstrip(" ")
+        if _indent(line) >= 4:
+            return _parse_code(line, lines)
+        elif _is_rule(line):
+            return HorizontalRuleLine()
+        elif stripped.startswith("#"):
+            return _parse_header(stripped, lines, inline)
+        elif stripped.startswith(">"):
+            return (yield from _parse_quote(stripped, lines))
+        else:
+            marker = _list_marker.match(line)
+            if marker:
+                return (yield from _parse_list(line, marker, lines))
+            return _parse_paragraph(line, lines, inline)
+    return None
+
+
+def _parse_code(line, lines):
+    code = [line[4:]]
+    blanks = []
+    for line in lines:
+        if not line.strip():
+            blanks.append(line[4:])
+        elif _indent(line) >= 4:
+            code.extend(blanks)
+            blanks = []
+            code.append(line[4:])
+        else:
+            lines.push(line)
+            break
+    return Code("\n".join(code))
+
+
+def _parse_header(stripped, lines, inline):
+    text = stripped.lstrip("#")
+    level = len(stripped) - len(text)
+    if level > 6:
+        return _parse_paragraph(stripped, lines, inline)
+    return Header(level, *inline.parse(text.strip().rstrip("#").rstrip()))
+
+
+def _parse_quote(stripped, lines):
+    quoted = []
+    while True:
+        stripped = stripped[1:]
+        if stripped.startswith(" "):
+            stripped = stripped[1:]
+        quoted.append(stripped)
+        line = next(lines, None)
+        if line is None:
+            break
+        stripped = line.lstrip(" ")
+        if not stripped.startswith(">") or _indent(line) >= 4:
+            lines.push(line)
+            break
+    blocks = yield quoted
+    return BlockQuote(*blocks)
+
+
+def _parse_paragraph(line, lines, inline):
+    text = [line.strip()]
+    for line in lines:
+        if not line.strip():
+            break
+        underline = line.strip()
+        if underline and underline == "=" * len(underline):
+            return Header(1, *inline.parse("\n".join(text)))
+        if underline and underline == "-" * len(underline):
+            return Header(2, *inline.parse("\n".join(text)))
+        if _starts_block(line):
+            lines.push(line)
+            break
+        text.append(line.strip())
+    return Paragraph(*inline.parse("\n".join(text)))
+
+
+def _is_ordered(marker):
+    return marker.group(1)[-1] == "."
+
+
+def _parse_list(line, marker, lines):
+    # An item is its marker line and every following line indented at least as
+    # far as the item's text (up to 4 spaces). A less indented marker of the
+    # same kind starts the next item, anything else ends the list.
+    ordered = _is_ordered(marker)
+    items = []
+    width = min(marker.end(), 4)
+    item_lines = [line[marker.end():]]
+    for line in lines:
+        if not line.strip():
+            item_lines.append("")
+            continue
+        indent = _indent(line)
+        if indent >= width:
+            item_lines.append(line[width:])
+            continue
+        next_marker = _list_marker.match(line)
+        if next_marker and _is_ordered(next_marker) == ordered and not _is_rule(line):
+            items.append(_list_item((yield item_lines)))
+            width = min(next_marker.end(), 4)
+            item_lines = [line[next_marker.end():]]
+        elif item_lines[-1].strip() and not next_marker and not _starts_block(line):
+            item_lines.append(line)
+        else:
+            lines.push(line)
+            break
+    items.append(_list_item((yield item_lines)))
+    return (OrderedList if ordered else UnorderedList)(*items)
+
+
+def _list_item(blocks):
+    # A list item is a single object: plain text or inline markup for a one
+    # paragraph item, a titled list for text followed by a list and Blocks
+    # for anything longer.
+    if not blocks:
+        return ""
+    first = blocks[0]
+    if type(first) is Paragraph and len(first.contents) == 1 and isinstance(first.contents[0], str):
+        if len(blocks) == 1:
+            return first.contents[0]
+        if len(blocks) == 2 and isinstance(blocks[1], _List) and not blocks[1].title:
+            blocks[1].title = first.contents[0]
+            return blocks[1]
+    if len(blocks) == 1:
+        return first
+    return Blocks(*blocks)
+
+
+class _InlineParser(object):
+    # One pass over the text puts text and delimiters in a flat list, a
+    # closing delimiter matches the nearest open one of its kind and drops the
+    # unmatched ones above it, which stay text. A second pass builds the nodes
+    # from the matched pairs. The word after a "^" is parsed as a text of its
+    # own, on a stack of texts instead of by recursion, and all the ones
+    # nested in it end where it ends.
+    def __init__(self, format_md):
+        self.reddit = format_md in (MarkdownFormats.reddit, MarkdownFormats.new_reddit)
+        self.emphasis = {"**": Bold, "*": Italic}
+        if self.reddit or format_md == MarkdownFormats.gfm:
+            from .reddit_specific.reddit_specific import Strikethrough, Superscript
+            self.emphasis["~~"] = Strikethrough
+            self.superscript = Superscript
+
+    def parse(self, text):
+        # Each text is [items, open delimiters, opened, starts,
+        # target_limits, start, end]. Open delimiters are [token, index in
+        # items, open parentheses], opened maps each token to the positions of
+        # its open delimiters on that stack and starts maps the index of a
+        # matched opening delimiter in items to the node it starts.
+        outer = []
+        (items, stack, opened, starts, target_limits, start, end) = current = [[], [], {}, {}, [0, 0], 0,
+                                                                                      len(text)]
+        pos = 0
+        while True:
+            match = _inline_token.search(text, pos, end)
+            if match is None:
+                if pos < end:
+                    items.append(text[pos:end])
+                if not outer:
+                    break
+                node = self.superscript(*_build(items, starts))
+                pos = end
+                (items, stack, opened, starts, target_limits, start, end) = current = outer.pop()
+                items.append(node)
+                continue
+            if match.start() > pos:
+                items.append(text[pos:match.start()])
+            token = match.group()
+            pos = match.end()
+
+            if token[0] == "\\":
+                items.append(Escaped(token[1]) if token[1] in _escapable else token)
+            elif token in self.emphasis or token == "***":
+                before = text[match.start() - 1:match.start()] if match.start() > start else ""
+                after = text[pos:pos + 1] if pos < end else ""
+                if token == "***":
+                    self._triple(items, stack, opened, starts, before, after)
+                else:
+                    self._emphasis(items, stack, opened, starts, token, before, after)
+            elif token == "^(" and self.reddit:
+                self._open(items, stack, opened, token)
+            elif token == "^" and self.reddit:
+                # A superscript's text is a word already, it ends with it.
+                word_end = _whitespace.search(text, pos, end) if not outer else None
+                word_end = end if word_end is None else word_end.start()
+                if word_end > pos:
+                    outer.append(current)
+                    (items, stack, opened, starts, target_limits, start, end) = current = [
+                        [], [], {}, {}, [0, 0], pos, word_end]
+                else:
+                    items.append(token)
+            elif token == "(":
+                if stack:
+                    stack[-1][2] += 1
+                items.append(token)
+            elif token == ")":
+                if stack and stack[-1][0] == "^(" and not stack[-1][2]:
+                    self._close(items, stack, opened, starts, "^(", self.superscript())
+                else:
+                    if stack and stack[-1][2]:
+                        stack[-1][2] -= 1
+                    items.append(token)
+            elif token in ("[", "!["):
+                self._open(items, stack, opened, token)
+            elif token == "](" and (opened.get("[") or opened.get("![")):
+                target_end = _target_end(text, pos, end, target_limits)
+                if target_end is None:
+                    items.append(token)
+                    continue
+                (url, title) = _split_target(text[pos:target_end])
+                pos = target_end + 1
+                if _nearest(opened, ("[", "![")) == "[":
+                    self._close(items, stack, opened, starts, "[", Link(url, "", title))
+                else:
+                    self._close(items, stack, opened, starts, "![", Image(url, "", title))
+            else:
+                items.append(token)
+        return _build(items, starts)
+
+    def _emphasis(self, items, stack, opened, starts, token, before, after):
+        if (opened.get(token) or (token in ("*", "**") and opened.get("***"))) and before.strip():
+            self._close(items, stack, opened, starts, token, self.emphasis[token]())
+        elif after.strip():
+            self._open(items, stack, opened, token)
+        else:
+            items.append(token)
+
+    def _triple(self, items, stack, opened, starts, before, after):
+        # "***" is Bold and Italic at once, the way Bold(Italic(...)) renders.
+        # It closes the open ones nearest first, what is left of it opens or
+        # stays text like a lone delimiter. Opened, it is one stack entry for
+        # two items, "**" for a Bold and "*" for an Italic inside it, until
+        # one of them is closed on its own.
+        nearest = _nearest(opened, ("*", "**", "***")) if before.strip() else None
+        if nearest == "***":
+            index = self._close(items, stack, opened, starts, "***", Bold())
+            starts[index + 1] = Italic()
+            items.append(None)
+        elif nearest is not None:
+            self._close(items, stack, opened, starts, nearest, self.emphasis[nearest]())
+            self._emphasis(items, stack, opened, starts, "**" if nearest == "*" else "*", before, after)
+        elif after.strip():
+            _push(stack, opened, "***", len(items))
+            items.extend(("**", "*"))
+        else:
+            items.append("***")
+
+    def _open(self, items, stack, opened, token):
+        _push(stack, opened, token, len(items))
+        items.append(token)
+
+    def _close(self, items, stack, opened, starts, token, node):
+        while True:
+            (kind, index, parentheses) = stack.pop()
+            opened[kind].pop()
+            if kind == token:
+                break
+            if kind == "***" and token in ("*", "**"):
+                # The inner half of a "***" closes, the outer one stays open.
+                other = "*" if token == "**" else "**"
+                (items[index], items[index + 1]) = (other, token)
+                _push(stack, opened, other, index)
+                stack[-1][2] = parentheses
+                index += 1
+                break
+        starts[index] = node
+        items.append(None)
+        return index
+
+
+def _build(items, starts):
+    # items holds text, finished nodes, the matched opening delimiters (by
+    # index in starts) and None for every matched closing one.
+    contents = []
+    pending = []
+    outer = []
+    for (i, item) in enumerate(items):
+        if i in starts:
+            outer.append((contents, pending, starts[i]))
+            contents = []
+            pending = []
+        elif item is None:
+            _flush(contents, pending)
+            node = outer[-1][2]
+            MarkdownFormattingObject.__init__(node, *contents)
+            (contents, pending, node) = outer.pop()
+            _flush(contents, pending)
+            contents.append(node)
+        elif isinstance(item, str):
+            pending.append(item)
+        else:
+            _flush(contents, pending)
+            contents.append(item)
+    _flush(contents, pending)
+    return contents
+
+
+def _flush(contents, pending):
+    if pending:
+        contents.append("".join(pending))
+        del pending[:]
+
+
+def _push(stack, opened, token, index):
+    opened.setdefault(token, []).append(len(stack))
+    stack.append([token, index, 0])
+
+
+def _nearest(opened, tokens):
+    # The one of tokens opened last, without walking the stack of delimiters.
+    nearest = None
+    position = -1
+    for token in tokens:
+        positions = opened.get(token)
+        if positions and positions[-1] > position:
+            (nearest, position) = (token, positions[-1])
+    return nearest
+
+
+def _target_end(text, pos, end, limits):
+    # Index of the ")" ending a link target before end, parentheses in the
+    # url have to be balanced. limits remembers up to where a line has no ")"
+    # left and up to where its parentheses can't be balanced, so no part of a
+    # line is searched more than once however many "](" it has.
+    eol = text.find("\n", pos, end)
+    if eol == -1:
+        eol = end
+    if pos < limits[0]:
+        return None
+    first = text.find(")", pos, eol)
+    if first == -1:
+        limits[0] = eol
+        return None
+    if pos < limits[1]:
+        return first
+    end = first
+    depth = text.count("(", pos, end)
+    while depth:
+        following = text.find(")", end + 1, eol)
+        if following == -1:
+            limits[1] = eol
+            return first
+        depth += text.count("(", end + 1, following) - 1
+        end = following
+    return end
+
+
+def _split_target(target):
+    target = target.strip()
+    if target.endswith('"'):
+        start = target.find(' "')
+        if start != -1:
+            return (target[:start].strip(), target[start + 2:-1])
+    return (target, "")
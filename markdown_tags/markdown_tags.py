@@ -1,18 +1,716 @@
 #!/usr/bin/env python
 #
 import collections
+import collections.abc
+import itertools
+import os
+import re
+import time
+import types
 
 import enum
 
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
 
 class MarkdownFormats(enum.Enum):
     basic = "basic"
     reddit = "reddit"
+    commonmark = "commonmark"
+    gfm = "gfm"
+    new_reddit = "new_reddit"
 
 class _MDTagsContext(object):
-    def __init__(self, recover, format_md):
+    def __init__(self, recover, format_md, auto_escape=False, cache=None, incremental=False, html=False,
+                 stats=None, compact=False):
         self.recover = recover
         self.format_md = format_md
+        self.dialect = _dialects[format_md]
+        self.auto_escape = auto_escape
+        self.cache = cache
+        self.incremental = incremental
+        self.html = html
+        self.stats = stats
+        self.compact = compact
+        self.placeholder_hook = None
+        self.newline = "\n"
+        self._outer_newlines = []
+        self._nested_renders = 0
+        # Texts that metrics rendered, by id of the node: (node, options, text).
+        self._measured = {}
+
+    def push_prefix(self, prefix):
+        self._outer_newlines.append(self.newline)
+        self.newline += prefix
+
+    def pop_prefix(self):
+        self.newline = self._outer_newlines.pop()
+
+    def options_key(self):
+        return (self.format_md, self.recover, self.auto_escape, self.compact)
+
+    def render_block(self, obj, cacheable=True):
+        # Top level blocks and list items go through here. Incremental renders
+        # keep each block's output on the block, the document API replaces
+        # changed blocks and their ancestors instead of changing them in place.
+        # Blocks nested deeper than _MAX_NESTED_RENDERS aren't kept, each kept
+        # block is a nested render on the Python stack. Only frozen blocks are
+        # cached, see RenderCache. Blocks with LazyContents below them can
+        # render differently every time, they are neither kept nor cached.
+        block = isinstance(obj, BlockLevel)
+        keep = self.incremental and block and self._nested_renders < _MAX_NESTED_RENDERS
+        if keep:
+            rendered = getattr(obj, "_rendered", None)
+            if rendered is not None and rendered[0] == self.options_key():
+                return rendered[1]
+        cache = self.cache if cacheable and block and obj.frozen else None
+        if (not keep and cache is None) or _has_lazy_contents(obj, self.format_md):
+            return (obj,)
+        if cache is not None:
+            output = cache.render(obj, self)
+        else:
+            output = self.render(obj)
+        if keep:
+            obj._rendered = (self.options_key(), output)
+        return output
+
+    def metrics(self, obj):
+        # TextMetrics of the node obj rendered on its own with these options,
+        # for checks that depend on the output. Kept on the node. The text is
+        # kept in this context for the node's render to take with
+        # take_measured, and goes with the context if nothing takes it.
+        # Subtrees with LazyContents are measured every time and their text
+        # isn't kept, iterators in them would be used up by measuring. Nor is
+        # it kept for renders with a RenderStats, which time the nodes in it.
+        key = self.options_key() + (self.html,)
+        metrics = _kept(obj, key)
+        if metrics is not None:
+            return metrics
+        (depth, lazy) = _subtree_depth(obj)
+        # With a RenderStats this is validation time of whoever measures.
+        stats = self.stats
+        self.stats = None
+        try:
+            text = self.render(obj)
+        finally:
+            self.stats = stats
+        metrics = TextMetrics(len(text), "\n" in text, isinstance(obj, BlockLevel), depth)
+        if not lazy:
+            _keep(obj, key, metrics)
+            if stats is None:
+                self._measured[id(obj)] = (obj, key, text)
+        return metrics
+
+    def take_measured(self, obj):
+        # The text metrics rendered obj to, or None. Only given out once, a
+        # node that measured itself while being validated is rendered once.
+        if self.placeholder_hook is not None or self.stats is not None:
+            return None
+        measured = self._measured.pop(id(obj), None)
+        if measured is None or measured[0] is not obj or measured[1] != self.options_key() + (self.html,):
+            return None
+        return measured[2]
+
+    def render(self, obj):
+        return self.render_frame(_iter_contents(obj if isinstance(obj, tuple) else (obj,), self))
+
+    def render_frame(self, frame):
+        saved = (self.newline, self._outer_newlines)
+        self.newline = "\n"
+        self._outer_newlines = []
+        self._nested_renders += 1
+        try:
+            return "".join(_drive(frame, self) if self.stats is None else _drive_profiled(frame, self))
+        finally:
+            (self.newline, self._outer_newlines) = saved
+            self._nested_renders -= 1
+
+
+_MAX_NESTED_RENDERS = 32
+
+
+def _iter_chunks(contents, opt_ctx):
+    if opt_ctx.stats is not None:
+        return _drive_profiled(_iter_contents(contents, opt_ctx), opt_ctx)
+    return _drive(_iter_contents(contents, opt_ctx), opt_ctx)
+
+
+def _drive(frame, opt_ctx):
+    # Nodes yield markup strings, child nodes and runs of contents (any other
+    # iterable, usually self.contents) from _iter_markdown. Children are
+    # expanded here instead of by recursion so every chunk is passed on once
+    # no matter how deep in the tree it was produced.
+    # Lists, quotes and code push a line prefix instead of re-indenting their
+    # rendered children, each newline gets the whole prefix once on the way out.
+    # What a node or run yields comes from its emitter in the dialect's table.
+    dialect = opt_ctx.dialect
+    emitters = dialect.html_emitters if opt_ctx.html else dialect.markdown_emitters
+    compact = opt_ctx.compact
+    stack = [frame]
+    while stack:
+        for chunk in stack[-1]:
+            if not isinstance(chunk, str):
+                emit = emitters.get(type(chunk)) or dialect.emitter(type(chunk), opt_ctx.html)
+                stack.append(emit(chunk, opt_ctx))
+                break
+            newline = opt_ctx.newline
+            if newline != "\n":
+                chunk = chunk.replace("\n", newline)
+                if compact:
+                    chunk = _strip_blank_lines(chunk, newline)
+            yield chunk
+        else:
+            stack.pop()
+
+
+def _drive_profiled(frame, opt_ctx):
+    # _drive for renders with a RenderStats. Each node's frame is timed from
+    # its first to its last chunk, text in its contents counts as its output.
+    # Time spent by whoever consumes the chunks is not counted.
+    stats = opt_ctx.stats
+    clock = stats.clock
+    dialect = opt_ctx.dialect
+    emitters = dialect.html_emitters if opt_ctx.html else dialect.markdown_emitters
+    compact = opt_ctx.compact
+    open_nodes = stats._open_nodes
+    depth = len(open_nodes)
+    stack = [(frame, open_nodes[-1] if open_nodes else None, False)]
+    try:
+        while stack:
+            (top, record, is_node) = stack[-1]
+            for chunk in top:
+                if not isinstance(chunk, str):
+                    emit = emitters.get(type(chunk)) or dialect.emitter(type(chunk), opt_ctx.html)
+                    if isinstance(chunk, MarkdownFormattingObject):
+                        child = stats._enter(_plain_type(chunk))
+                        stack.append((emit(chunk, opt_ctx), child, True))
+                    else:
+                        stack.append((emit(chunk, opt_ctx), record, False))
+                    break
+                newline = opt_ctx.newline
+                if newline != "\n":
+                    chunk = chunk.replace("\n", newline)
+                    if compact:
+                        chunk = _strip_blank_lines(chunk, newline)
+                if record is not None:
+                    record[4] += len(chunk)
+                paused = clock()
+                yield chunk
+                stats._paused += clock() - paused
+            else:
+                stack.pop()
+                if is_node:
+                    stats._leave(record)
+    finally:
+        del open_nodes[depth:]
+
+
+def _strip_blank_lines(chunk, newline):
+    # Blank lines inside list items need no indentation, quotes keep their ">".
+    return chunk.replace(newline + "\n", newline.rstrip(" ") + "\n")
+
+
+def _iter_contents(contents, opt_ctx):
+    # Plain strings in contents are text leaves, unlike the markup strings
+    # nodes yield themselves, so this is where escaping applies to them.
+    for c in contents:
+        if isinstance(c, str):
+            if opt_ctx.html:
+                c = _escape_html(c)
+            elif opt_ctx.auto_escape:
+                c = escape(c)
+        yield c
+
+
+def _iter_expanded(contents, opt_ctx):
+    # contents with the items of LazyContents runs in place of the runs.
+    for c in contents:
+        if isinstance(c, LazyContents):
+            yield from c._iter_items(opt_ctx)
+        else:
+            yield c
+
+
+def _iter_html_flow(contents):
+    # Inline children directly inside a list item or quote become a
+    # paragraph, the way markdown renders them.
+    inline = []
+    for c in contents:
+        if isinstance(c, BlockLevel):
+            if inline:
+                yield "<p>"
+                yield tuple(inline)
+                yield "</p>\n"
+                inline = []
+            yield c
+            yield "\n"
+        else:
+            inline.append(c)
+    if inline:
+        yield "<p>"
+        yield tuple(inline)
+        yield "</p>\n"
+
+
+class RenderCache(object):
+    # Rendered output of frozen top level blocks, keyed on the block itself and
+    # the render options, so a footer shared by many documents is rendered
+    # once. A frozen block can't change, looking it up is one dict lookup
+    # however large it is. Other blocks would need a key of their whole
+    # structure, which costs about as much as rendering them, they are
+    # rendered without the cache and counted neither as hits nor misses.
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, obj, opt_ctx):
+        key = (id(obj),) + opt_ctx.options_key()
+        entries = self._entries
+        try:
+            rendered = entries[key][1]
+        except KeyError:
+            self.misses += 1
+            rendered = opt_ctx.render(obj)
+            # The entry keeps obj alive, so its id can't be reused meanwhile.
+            entries[key] = (obj, rendered)
+            if len(entries) > self.maxsize:
+                entries.popitem(last=False)
+        else:
+            self.hits += 1
+            entries.move_to_end(key)
+        return rendered
+
+
+def _has_lazy_contents(obj, format_md):
+    # Whether the subtree of obj has LazyContents. Validation doesn't keep
+    # masks on those subtrees, one kept for obj answers without a walk.
+    if _kept(obj, format_md) is not None:
+        return False
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, LazyContents):
+            return True
+        if not isinstance(node, (str, MFOWrapper)):
+            stack.extend(node.contents)
+    return False
+
+
+class TextMetrics(object):
+    # What a node renders to: its length in characters, whether it has a
+    # newline, whether the node is a block and the depth of its subtree (1
+    # for a node with only text).
+    __slots__ = ("length", "newline", "block", "depth")
+
+    def __init__(self, length, newline, block, depth):
+        self.length = length
+        self.newline = newline
+        self.block = block
+        self.depth = depth
+
+    def __repr__(self):
+        return "TextMetrics(length=%d, newline=%r, block=%r, depth=%d)" % (
+            self.length, self.newline, self.block, self.depth)
+
+
+def _subtree_depth(obj):
+    # Depth of the subtree and whether it has LazyContents.
+    depth = 0
+    lazy = False
+    stack = [(obj, 1)]
+    while stack:
+        (node, node_depth) = stack.pop()
+        depth = max(depth, node_depth)
+        if isinstance(node, LazyContents):
+            if not callable(node.source):
+                raise ValueError("Contents given as an iterator can't be measured before they are rendered")
+            lazy = True
+        elif not isinstance(node, MFOWrapper):
+            stack.extend((c, node_depth + 1) for c in node.contents if not isinstance(c, str))
+    return (depth, lazy)
+
+
+class NodeStats(object):
+    # Totals for one node class. Times are in seconds of RenderStats.clock,
+    # chars counts the markup and text the class's nodes emitted themselves.
+    __slots__ = ("calls", "cumulative_time", "self_time", "chars", "validations", "validation_time")
+
+    def __init__(self):
+        self.calls = 0
+        self.cumulative_time = 0.0
+        self.self_time = 0.0
+        self.chars = 0
+        self.validations = 0
+        self.validation_time = 0.0
+
+    def __repr__(self):
+        return ("NodeStats(calls=%d, cumulative_time=%.6f, self_time=%.6f, chars=%d, "
+                "validations=%d, validation_time=%.6f)" % (
+                    self.calls, self.cumulative_time, self.self_time, self.chars,
+                    self.validations, self.validation_time))
+
+
+class RenderStats(object):
+    # Collects NodeStats per node class over every render it is passed to,
+    # subclasses defined outside this module included.
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.by_class = {}
+        self._open_nodes = []
+        self._paused = 0.0
+        self._validation_child_time = 0.0
+
+    def __getitem__(self, cls):
+        return self.by_class[cls]
+
+    def __contains__(self, cls):
+        return cls in self.by_class
+
+    def clear(self):
+        self.by_class.clear()
+
+    def _entry(self, cls):
+        try:
+            return self.by_class[cls]
+        except KeyError:
+            return self.by_class.setdefault(cls, NodeStats())
+
+    def _enter(self, cls):
+        # [class, start, paused time at start, time in child nodes, chars]
+        record = [cls, self.clock(), self._paused, 0.0, 0]
+        self._open_nodes.append(record)
+        return record
+
+    def _leave(self, record):
+        self._open_nodes.pop()
+        elapsed = self.clock() - record[1] - (self._paused - record[2])
+        entry = self._entry(record[0])
+        entry.calls += 1
+        entry.cumulative_time += elapsed
+        entry.self_time += elapsed - record[3]
+        entry.chars += record[4]
+        if self._open_nodes:
+            self._open_nodes[-1][3] += elapsed
+
+    def report(self, sort_by="self_time"):
+        lines = ["%-30s %8s %12s %12s %10s %12s" % ("class", "calls", "cumulative", "self", "chars",
+                                                     "validation")]
+        for (cls, entry) in sorted(self.by_class.items(), key=lambda item: getattr(item[1], sort_by),
+                                   reverse=True):
+            lines.append("%-30s %8d %12.6f %12.6f %10d %12.6f" % (
+                cls.__name__, entry.calls, entry.cumulative_time, entry.self_time, entry.chars,
+                entry.validation_time))
+        return "\n".join(lines)
+
+
+_option_attributes = {}
+
+
+def _node_options(obj):
+    # (name, value) pairs of everything but contents that a node renders from.
+    cls = type(obj)
+    try:
+        attributes = _option_attributes[cls]
+    except KeyError:
+        attributes = _option_attributes[cls] = tuple(
+            a for c in cls.__mro__ for a in c.__dict__.get("__slots__", ())
+            if a != "contents" and not a.startswith("_"))
+    options = tuple((a, getattr(obj, a)) for a in attributes)
+    if hasattr(obj, "__dict__"):
+        options += tuple(sorted(vars(obj).items()))
+    return options
+
+
+def _structure_key(obj):
+    # Equal for trees that render the same: class, options and contents. A
+    # flat tuple of the subtree in post-order, text as it is, (class, text) for
+    # wrapped objects and (class, options, number of children) after a node's
+    # children, so neither building nor hashing or comparing keys recurses.
+    # Frozen nodes can't change, they keep the key asked for with their
+    # validation results and use the ones kept below them.
+    if isinstance(obj, str):
+        return obj
+    frozen = obj.frozen
+    if frozen:
+        kept = _kept(obj, _structure_key_entry)
+        if kept is not None:
+            return kept
+    key = []
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (str, tuple)):
+            key.append(node)
+        elif isinstance(node, MFOWrapper):
+            key.append((_plain_type(node), str(node.contents)))
+        else:
+            if node is not obj and node.frozen:
+                kept = _kept(node, _structure_key_entry)
+                if kept is not None:
+                    key.extend(kept)
+                    continue
+            stack.append((_plain_type(node), _node_options(node), len(node.contents)))
+            stack.extend(reversed(node.contents))
+    key = tuple(key)
+    if frozen:
+        _keep(obj, _structure_key_entry, key)
+    return key
+
+
+# Where frozen nodes keep their structure key, see _keep.
+_structure_key_entry = "structure_key"
+
+
+class InternTable(object):
+    # Hash-consing: intern returns the tree with every subtree replaced by the
+    # first equal one this table has seen, so equal subtrees of many documents
+    # are one object and equal strings one string. Blocks/MD are edited in
+    # place and LazyContents are consumed, those and their parents are never
+    # shared, only their children. Interned nodes are shared and must not be
+    # changed. With a maxsize the least recently used nodes and strings are
+    # forgotten beyond maxsize of each.
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._nodes = collections.OrderedDict()
+        self._strings = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def clear(self):
+        self._nodes.clear()
+        self._strings.clear()
+
+    def intern(self, obj):
+        # Children are interned before their parent, from an explicit stack
+        # so deep trees don't recurse. A (node,) tuple on the stack finishes
+        # node once its children are done.
+        done = []
+        stack = [obj]
+        while stack:
+            node = stack.pop()
+            if type(node) is tuple:
+                node = node[0]
+                start = len(done) - len(node.contents)
+                contents = tuple(done[start:])
+                del done[start:]
+                done.append(self._intern_node(node, contents))
+            elif isinstance(node, str):
+                done.append(self._shared(self._strings, node, node))
+            elif isinstance(node, (MFOWrapper, LazyContents)):
+                done.append(self._intern_node(node, node.contents))
+            else:
+                stack.append((node,))
+                stack.extend(reversed(node.contents))
+        return done[0]
+
+    def _intern_node(self, obj, contents):
+        if isinstance(obj, MFOWrapper):
+            return self._shared(self._nodes, (MFOWrapper, str(obj.contents)), obj)
+        if any(new is not old for (new, old) in zip(contents, obj.contents)):
+            obj = _copy_with_contents(obj, contents)
+        if isinstance(obj, (Blocks, LazyContents)) or any(isinstance(c, LazyContents) for c in contents):
+            return obj
+        # Children are interned already, their identity stands for their
+        # structure. An entry keeps its children alive, so their ids can't be
+        # reused while it is there.
+        key = (_plain_type(obj), _node_options(obj), tuple(c if isinstance(c, str) else id(c) for c in contents))
+        return self._shared(self._nodes, key, obj)
+
+    def _shared(self, entries, key, obj):
+        try:
+            shared = entries.setdefault(key, obj)
+        except TypeError:
+            # An option that can't be hashed, like a Table cell that is a list.
+            return obj
+        if self.maxsize is not None:
+            entries.move_to_end(key)
+            if len(entries) > self.maxsize:
+                entries.popitem(last=False)
+        return shared
+
+
+_intern_table = InternTable(maxsize=4096)
+
+
+def interned(obj):
+    # InternTable.intern with one table shared by the whole process, which
+    # keeps the 4096 most recently used nodes and strings.
+    return _intern_table.intern(obj)
+
+
+def _dump_tree(obj):
+    # A flat list in post-order like _structure_key, with wrapped objects as
+    # their text and LazyContents expanded. Dumping, pickling and loading it
+    # don't recurse, and pickling only stores each class once.
+    dumped = []
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (str, tuple)):
+            dumped.append(node)
+        elif isinstance(node, MFOWrapper):
+            dumped.append(str(node.contents))
+        else:
+            contents = list(_iter_expanded(node.contents, None))
+            stack.append((_plain_type(node), _node_options(node), len(contents)))
+            stack.extend(reversed(contents))
+    return dumped
+
+
+def _load_tree(dumped):
+    # Every node comes after its children, which are the last ones built.
+    built = []
+    for item in dumped:
+        if isinstance(item, str):
+            built.append(item)
+            continue
+        (cls, options, count) = item
+        start = len(built) - count
+        obj = cls.__new__(cls)
+        MarkdownFormattingObject.__init__(obj, *built[start:])
+        del built[start:]
+        for (name, value) in options:
+            setattr(obj, name, value)
+        built.append(obj)
+    return built[0]
+
+
+_POOL_MIN_TREES = 64
+
+
+def _render_dumped_batch(batch):
+    (dumped_trees, recover, format_md, auto_escape) = batch
+    return [_load_tree(dumped).tags_to_markdown(recover, format_md, auto_escape)
+            for dumped in dumped_trees]
+
+
+def render_many(trees, format_md, recover, workers=None, chunksize=None, ordered=True, auto_escape=False,
+                threads=False):
+    # Renders MD trees in a process pool. Returns the markdown strings in
+    # order, or with ordered=False an iterator of (index, markdown) pairs as
+    # batches complete. Small batches are rendered in this process.
+    # With threads=True frozen trees are rendered in a thread pool instead,
+    # without copying them to other processes. format_md can then also be a
+    # sequence of formats, every tree is rendered in each and gives a tuple.
+    trees = list(trees)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if threads:
+        return _render_threaded(trees, format_md, recover, workers, ordered, auto_escape)
+    if workers <= 1 or len(trees) < _POOL_MIN_TREES:
+        rendered = [t.tags_to_markdown(recover, format_md, auto_escape) for t in trees]
+        return rendered if ordered else enumerate(rendered)
+
+    if chunksize is None:
+        chunksize = max(1, len(trees) // (workers * 4))
+    batches = [([_dump_tree(t) for t in trees[i:i + chunksize]], recover, format_md, auto_escape)
+               for i in range(0, len(trees), chunksize)]
+    if ordered:
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            return [markdown_str for rendered in executor.map(_render_dumped_batch, batches)
+                    for markdown_str in rendered]
+    return _iter_rendered_as_completed(batches, chunksize, workers)
+
+
+def _iter_rendered_as_completed(batches, chunksize, workers):
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        starts = dict((executor.submit(_render_dumped_batch, batch), i * chunksize)
+                      for (i, batch) in enumerate(batches))
+        for future in concurrent.futures.as_completed(starts):
+            for (i, markdown_str) in enumerate(future.result(), start=starts[future]):
+                yield (i, markdown_str)
+
+
+def _render_threaded(trees, format_md, recover, workers, ordered, auto_escape):
+    for tree in trees:
+        if not tree.frozen:
+            raise ValueError("Only frozen trees can be rendered from several threads, call freeze() first")
+    formats = (format_md,) if isinstance(format_md, MarkdownFormats) else tuple(format_md)
+    # One job per tree and format, a single tree in several formats is
+    # rendered in parallel too.
+    jobs = [(tree, f) for tree in trees for f in formats]
+    if workers <= 1 or len(jobs) <= 1:
+        rendered = [tree.tags_to_markdown(recover, f, auto_escape) for (tree, f) in jobs]
+    elif ordered:
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            rendered = list(executor.map(lambda job: job[0].tags_to_markdown(recover, job[1], auto_escape), jobs))
+    else:
+        return _iter_rendered_threaded(jobs, len(formats), isinstance(format_md, MarkdownFormats), recover,
+                                       workers, auto_escape)
+    if isinstance(format_md, MarkdownFormats):
+        return rendered if ordered else enumerate(rendered)
+    grouped = [tuple(rendered[i:i + len(formats)]) for i in range(0, len(rendered), len(formats))]
+    return grouped if ordered else enumerate(grouped)
+
+
+def _iter_rendered_threaded(jobs, format_count, single_format, recover, workers, auto_escape):
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        positions = dict((executor.submit(tree.tags_to_markdown, recover, f, auto_escape), i)
+                         for (i, (tree, f)) in enumerate(jobs))
+        pending = {}
+        for future in concurrent.futures.as_completed(positions):
+            (index, position) = divmod(positions[future], format_count)
+            if single_format:
+                yield (index, future.result())
+                continue
+            rendered = pending.setdefault(index, [None] * format_count)
+            rendered[position] = future.result()
+            if None not in rendered:
+                del pending[index]
+                yield (index, tuple(rendered))
+
+
+def _wrap(obj, lazy=False):
+    if isinstance(obj, (str, MarkdownFormattingObject)):
+        return obj
+    if lazy and (isinstance(obj, collections.abc.Iterator) or (callable(obj) and not isinstance(obj, type))):
+        return LazyContents(obj)
+    return MFOWrapper(obj)
+
+
+def _as_path(path):
+    if isinstance(path, int):
+        return (path,)
+    return tuple(path)
+
+
+def _copy_with_contents(node, contents):
+    import copy
+    new_node = copy.copy(node)
+    # Copies of frozen nodes are plain nodes, see _reduce_frozen.
+    new_node._validated = None
+    new_node.contents = contents
+    if isinstance(new_node, BlockLevel):
+        new_node._rendered = None
+    return new_node
+
+
+def _copy_along(node, path, edit):
+    # Copies the nodes on path instead of changing them, other documents and
+    # the output remembered on untouched blocks stay valid.
+    if not path:
+        return edit(node)
+    (index, rest) = (path[0], path[1:])
+    child = _copy_along(node.contents[index], rest, edit)
+    return _copy_with_contents(node, node.contents[:index] + (child,) + node.contents[index + 1:])
 
 
 class IllegalMarkdownFormattingException(Exception):
@@ -20,120 +718,585 @@ class IllegalMarkdownFormattingException(Exception):
 
 
 class MarkdownFormattingObject(object):
+    __slots__ = ("contents", "_validated")
+    # Whether iterators and callables in contents become LazyContents.
+    _lazy_contents = False
+    # Whether the node's output may have newlines in it.
+    _newlines_allowed = True
+
     def __init__(self, *contents):
         self.contents = contents
+        self._validated = None
         self._wrap_unwrapped()
 
     def _wrap_unwrapped(self):
-        self.contents = tuple(c if isinstance(c, MarkdownFormattingObject)
-                              else MFOWrapper(c)
-                              for c in self.contents)
+        # Strings are stored as they are, only other objects get an MFOWrapper.
+        for c in self.contents:
+            if not isinstance(c, (str, MarkdownFormattingObject)):
+                self.contents = tuple(_wrap(c, self._lazy_contents) for c in self.contents)
+                break
 
     def __repr__(self):
         return repr(type(self)) + "(" + repr(self.contents) + ")"
 
-    def _check_recursive(self, banned_class_exception_tuples, opt_ctx):
-        my_type = type(self)
+    # Nodes that render the same are equal and hash the same, both walk the
+    # whole subtree. Changing a node used as a dict key loses the entry.
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, MarkdownFormattingObject):
+            return NotImplemented
+        return _structure_key(self) == _structure_key(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(_structure_key(self))
+
+    @property
+    def frozen(self):
+        return type(self) in _plain_classes
+
+    def freeze(self):
+        # Makes this node and everything below it immutable, so the tree can
+        # be shared and rendered by several threads at once. Returns self.
+        # Frozen nodes become instances of a subclass that refuses changes,
+        # setting attributes on any other node costs nothing extra.
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str) or node.frozen:
+                continue
+            node._freeze_options()
+            node.__class__ = _frozen_class(type(node))
+            if not isinstance(node, MFOWrapper):
+                stack.extend(node.contents)
+        return self
+
+    def _freeze_options(self):
+        pass
+
+    def metrics(self, format_md, recover=False, auto_escape=False, compact=False):
+        # TextMetrics of this node rendered on its own, for size and line
+        # checks of your own. They are kept on the node with the ones
+        # validators asked for, the same options don't render it again.
+        opt_ctx = _MDTagsContext(recover=recover, format_md=format_md, auto_escape=auto_escape, compact=compact)
+        if not recover:
+            self._check_recursive(opt_ctx)
+        return opt_ctx.metrics(self)
+
+    def _iter_markdown(self, opt_ctx):
+        yield self._tags_to_markdown(opt_ctx)
+
+    def _tags_to_markdown(self, opt_ctx):
+        return opt_ctx.render(self)
+
+    def _iter_html(self, opt_ctx):
+        yield self.contents
+
+    def _check_recursive(self, opt_ctx):
+        _validate(self, 0, _nesting_rules_for(opt_ctx.format_md), opt_ctx)
+
+    def _check(self, opt_ctx):
+        pass
+
+    @classmethod
+    def _check_contents(cls, contents):
+        # Checks on the direct children that don't need the node itself, also
+        # run on the items of LazyContents as they are rendered.
+        pass
 
-        if not isinstance(self, _RepeatableBlockLevel):
-            possible_match = [t for t in banned_class_exception_tuples if my_type == t[0]]
-            if possible_match:
-                raise possible_match[0][1](self)
-            banned_class_exception_tuples = (banned_class_exception_tuples +
-                                             [(my_type, lambda s:
-                                             IllegalMarkdownFormattingException(
-                                                 "Illegal nested MarkdownFormattingTags class " +
-                                                 str(type(self))))])
 
-        for item in self.contents:
-            item._check_recursive(banned_class_exception_tuples, opt_ctx)
+# The frozen subclass of every class that had a node frozen, and back.
+_frozen_classes = {}
+_plain_classes = {}
+
+
+def _frozen_class(cls):
+    try:
+        return _frozen_classes[cls]
+    except KeyError:
+        pass
+    frozen_cls = type(cls.__name__, (cls,), {
+        "__slots__": (), "__module__": cls.__module__, "__qualname__": cls.__qualname__,
+        "__setattr__": _setattr_frozen, "__delattr__": _delattr_frozen, "__reduce_ex__": _reduce_frozen})
+    frozen_cls = _frozen_classes.setdefault(cls, frozen_cls)
+    _plain_classes[frozen_cls] = cls
+    return frozen_cls
+
+
+def _plain_type(node):
+    # The class of node as it was built, also for frozen nodes.
+    cls = type(node)
+    return _plain_classes.get(cls, cls)
+
+
+# Attributes starting with "_" hold validation and render results, those still
+# change on frozen nodes.
+def _setattr_frozen(node, name, value):
+    if name[0] != "_":
+        raise AttributeError("Can't set " + name + " of a frozen " + type(node).__name__)
+    object.__setattr__(node, name, value)
+
+
+def _delattr_frozen(node, name):
+    if name[0] != "_":
+        raise AttributeError("Can't delete " + name + " of a frozen " + type(node).__name__)
+    object.__delattr__(node, name)
+
+
+def _reduce_frozen(node, protocol):
+    # Copies and pickles of a frozen node are plain nodes that can change.
+    reduced = object.__reduce_ex__(node, protocol)
+    return (reduced[0], (_plain_type(node),) + reduced[1][1:]) + reduced[2:]
 
 
 class MFOWrapper(MarkdownFormattingObject):
+    __slots__ = ()
+
     def __init__(self, obj):
         self.contents = obj
+        self._validated = None
 
     def __repr__(self):
         return repr(self.contents)
 
-    def _check_recursive(self, banned_class_exception_tuples, opt_ctx):
-        pass
+    def _freeze_options(self):
+        # The wrapped object could still change, its text can't.
+        self.contents = str(self.contents)
+
+    def _iter_markdown(self, opt_ctx):
+        yield self._tags_to_markdown(opt_ctx)
 
     def _tags_to_markdown(self, opt_ctx):
+        if opt_ctx.auto_escape:
+            return escape(str(self.contents))
         return str(self.contents)
 
+    def _iter_html(self, opt_ctx):
+        yield _escape_html(str(self.contents))
+
 
 class Blocks(MarkdownFormattingObject):
-    def _tags_to_markdown(self, opt_ctx):
-        return "\n\n".join(c._tags_to_markdown(opt_ctx) for c in self.contents)
+    __slots__ = ()
+    _lazy_contents = True
+
+    def _iter_markdown(self, opt_ctx):
+        for (i, c) in enumerate(_iter_expanded(self.contents, opt_ctx)):
+            if i:
+                yield "\n\n"
+            yield opt_ctx.render_block(c)
+
+    def _iter_html(self, opt_ctx):
+        for (i, c) in enumerate(_iter_expanded(self.contents, opt_ctx)):
+            if i:
+                yield "\n"
+            yield (c,)
+
+    def append(self, block):
+        self.insert((), len(self.contents), block)
+
+    def insert(self, path, index, obj):
+        # Inserts obj at index into the Blocks or list found by following the
+        # child indices in path, () is this node itself.
+        self._edit(_as_path(path), lambda container: _copy_with_contents(
+            container, container.contents[:index] + (_wrap(obj, container._lazy_contents),) +
+            container.contents[index:]))
+
+    def replace(self, path, obj):
+        path = _as_path(path)
+        index = path[-1]
+        self._edit(path[:-1], lambda container: _copy_with_contents(
+            container, container.contents[:index] + (_wrap(obj, container._lazy_contents),) +
+            container.contents[index + 1:]))
+
+    def _edit(self, path, edit):
+        self.contents = _copy_along(self, path, edit).contents
+        self._validated = None
+
+    def _check(self, opt_ctx):
+        self._check_contents(self.contents)
 
-    def _check_recursive(self, banned_class_exception_tuples, opt_ctx):
-        second_level_non_block_elements = [c for c in self.contents
-                                           if not isinstance(c, BlockLevel)]
+    @classmethod
+    def _check_contents(cls, contents):
+        second_level_non_block_elements = [c for c in contents
+                                           if not isinstance(c, (BlockLevel, LazyContents))]
         if second_level_non_block_elements:
             raise IllegalMarkdownFormattingException(
                 "Only block elements are allowed as second level elements," +
                 " not allowed:" + str(second_level_non_block_elements))
-        super(Blocks, self)._check_recursive(banned_class_exception_tuples, opt_ctx)
 
 
 class MD(Blocks):
+    __slots__ = ()
+
     def _tags_to_markdown(self, opt_ctx):
         if not opt_ctx.recover:
-            self._check_recursive([], opt_ctx)
+            self._check_recursive(opt_ctx)
         return super(MD, self)._tags_to_markdown(opt_ctx)
 
-    def tags_to_markdown(self, recover, format_md):
-        opt_ctx = _MDTagsContext(recover=recover, format_md=format_md)
-        return self._tags_to_markdown(opt_ctx)
+    def tags_to_markdown(self, recover, format_md, auto_escape=False, cache=None, incremental=False,
+                         stats=None, compact=False):
+        # compact=True writes the shortest markdown this library knows for
+        # the same HTML: no indentation on blank lines, no blank lines after
+        # the last list item, every ordered item numbered 1 and short rules.
+        return "".join(self.iter_markdown(recover, format_md, auto_escape, cache, incremental, stats, compact))
+
+    def iter_markdown(self, recover, format_md, auto_escape=False, cache=None, incremental=False,
+                      stats=None, compact=False):
+        opt_ctx = _MDTagsContext(recover=recover, format_md=format_md, auto_escape=auto_escape,
+                                 cache=cache, incremental=incremental, stats=stats, compact=compact)
+        if not recover:
+            self._check_recursive(opt_ctx)
+        return _iter_chunks((self,), opt_ctx)
+
+    def tags_to_html(self, format_md, recover=False, stats=None):
+        opt_ctx = _MDTagsContext(recover=recover, format_md=format_md, html=True, stats=stats)
+        if not recover:
+            self._check_recursive(opt_ctx)
+        return "".join(_iter_chunks((self,), opt_ctx))
+
+    def write_markdown(self, fp, recover, format_md, auto_escape=False, cache=None, incremental=False,
+                       stats=None, compact=False):
+        write = fp.write
+        for chunk in self.iter_markdown(recover, format_md, auto_escape, cache, incremental, stats, compact):
+            write(chunk)
+
+    def tags_to_bytes(self, recover, format_md, auto_escape=False, cache=None, incremental=False, stats=None,
+                      compact=False):
+        # tags_to_markdown encoded as UTF-8 without building it as one str.
+        # Chunks are encoded a batch at a time and join copies every batch
+        # once into bytes of the exact size.
+        return b"".join(_iter_encoded(self.iter_markdown(recover, format_md, auto_escape, cache, incremental,
+                                                         stats, compact)))
+
+    def render_into(self, buffer, recover, format_md, auto_escape=False, offset=0, cache=None, incremental=False,
+                    stats=None, compact=False):
+        # Writes the markdown as UTF-8 into buffer, a bytearray or writable
+        # memoryview, starting at offset and returns the number of bytes
+        # written. Chunks are encoded a batch at a time, the whole output is
+        # never held as one str or bytes. The batches are only copied into
+        # buffer once they are known to fit, when buffer is too small it is
+        # left as it was and ValueError tells the size needed.
+        batches = list(_iter_encoded(self.iter_markdown(recover, format_md, auto_escape, cache, incremental,
+                                                        stats, compact)))
+        with memoryview(buffer).cast("B") as view:
+            end = offset + sum(len(batch) for batch in batches)
+            if end > len(view):
+                raise ValueError("Rendering needs " + str(end) + " bytes of buffer, it has " + str(len(view)))
+            pos = offset
+            for batch in batches:
+                view[pos:pos + len(batch)] = batch
+                pos += len(batch)
+        return end - offset
+
+    def split_to_limit(self, max_chars, format_md, recover=False, auto_escape=False, compact=False):
+        # Renders every block once and packs them greedily into as few
+        # markdown strings of at most max_chars as possible. Lists that do not
+        # fit into one string on their own are split between items, ordered
+        # numbering carries on in the next string.
+        opt_ctx = _MDTagsContext(recover=recover, format_md=format_md, auto_escape=auto_escape, compact=compact)
+        if not recover:
+            self._check_recursive(opt_ctx)
+        chunks = []
+        current = []
+        length = 0
+        for block in _iter_expanded(self.contents, opt_ctx):
+            if isinstance(block, _List):
+                parts = block._rendered_parts(opt_ctx)
+                if sum(len(part) for part in parts) <= max_chars:
+                    parts = ["".join(parts)]
+            else:
+                parts = [opt_ctx.render(block)]
+            separator = "\n\n"
+            for part in parts:
+                if len(part) > max_chars:
+                    raise ValueError("A block of " + str(len(part)) +
+                                     " characters can't be split to fit in " + str(max_chars))
+                if current and length + len(separator) + len(part) > max_chars:
+                    chunks.append("".join(current))
+                    current = []
+                    length = 0
+                if current:
+                    current.append(separator)
+                    length += len(separator)
+                current.append(part)
+                length += len(part)
+                separator = ""
+        if current:
+            chunks.append("".join(current))
+        return chunks
+
+    def compile(self, format_md, recover=False, auto_escape=True):
+        opt_ctx = _MDTagsContext(recover=recover, format_md=format_md, auto_escape=auto_escape)
+        if not recover:
+            self._check_recursive(opt_ctx)
+        parts = []
+        slots = []
+
+        def add_slot(placeholder, opt_ctx):
+            parts.append(None)
+            slots.append((len(parts) - 1, _TemplateSlot(placeholder.name, opt_ctx,
+                                                        placeholder._ancestors.get(opt_ctx.format_md, ()))))
+
+        opt_ctx.placeholder_hook = add_slot
+        for chunk in _iter_chunks((self,), opt_ctx):
+            if parts and parts[-1] is not None:
+                parts[-1] += chunk
+            else:
+                parts.append(chunk)
+        return CompiledTemplate(parts, slots)
+
+
+_BYTES_BATCH_CHUNKS = 1 << 12
+
+
+def _iter_encoded(chunks):
+    # chunks encoded as UTF-8 in batches of _BYTES_BATCH_CHUNKS, taken and
+    # joined in C.
+    chunks = iter(chunks)
+    while True:
+        batch = list(itertools.islice(chunks, _BYTES_BATCH_CHUNKS))
+        if not batch:
+            return
+        yield "".join(batch).encode("utf-8")
+
+
+class Placeholder(MarkdownFormattingObject):
+    # Stands for a value that is only filled in by CompiledTemplate.render.
+    # Validation remembers the classes of its ancestors per format, outermost
+    # first, its value is checked against them when it is filled in.
+    __slots__ = ("name", "_ancestors")
+
+    def __init__(self, name):
+        self.name = name
+        self._ancestors = {}
+        super(Placeholder, self).__init__()
+
+    def __repr__(self):
+        return repr(type(self)) + "(" + repr(self.name) + ")"
+
+    def _iter_markdown(self, opt_ctx):
+        if opt_ctx.placeholder_hook is None:
+            raise IllegalMarkdownFormattingException("Placeholder " + repr(self.name) +
+                                                     " can only be rendered through MD.compile")
+        opt_ctx.placeholder_hook(self, opt_ctx)
+        return iter(())
+
+    def _iter_html(self, opt_ctx):
+        raise IllegalMarkdownFormattingException("Placeholder " + repr(self.name) +
+                                                 " can only be rendered through MD.compile")
+
+
+class LazyContents(MarkdownFormattingObject):
+    # Contents of a list, Blocks or Paragraph that are only taken from source
+    # while rendering: an iterator, used up by the first render, or a callable
+    # returning an iterable on every render. Items are checked as they come,
+    # against the ancestors the run had when the tree was validated.
+    __slots__ = ("source", "_ancestors")
+
+    def __init__(self, source):
+        self.source = source
+        self._ancestors = {}
+        super(LazyContents, self).__init__()
+
+    def __repr__(self):
+        return repr(type(self)) + "(" + repr(self.source) + ")"
+
+    def _freeze_options(self):
+        if not callable(self.source):
+            raise ValueError("Contents given as an iterator can only be rendered once and can't be frozen, "
+                             "pass a function returning an iterable instead")
+
+    def _iter_items(self, opt_ctx):
+        source = self.source() if callable(self.source) else self.source
+        if opt_ctx is None or opt_ctx.recover:
+            for item in source:
+                yield _wrap(item)
+            return
+        rules = _nesting_rules_for(opt_ctx.format_md)
+        (ancestors, parent_class) = self._ancestors.get(opt_ctx.format_md, (0, MarkdownFormattingObject))
+        for item in source:
+            item = _wrap(item)
+            parent_class._check_contents((item,))
+            _validate(item, ancestors, rules, opt_ctx)
+            yield item
+
+    def _iter_markdown(self, opt_ctx):
+        yield self._iter_items(opt_ctx)
+
+    def _iter_html(self, opt_ctx):
+        yield self._iter_items(opt_ctx)
+
+
+class _TemplateSlot(object):
+    # ancestor_classes are those of the Placeholder's ancestors when the tree
+    # was validated, a value is checked as if it had been in the tree.
+    __slots__ = ("name", "recover", "format_md", "auto_escape", "newline", "ancestor_classes")
+
+    def __init__(self, name, opt_ctx, ancestor_classes=()):
+        self.name = name
+        self.recover = opt_ctx.recover
+        self.format_md = opt_ctx.format_md
+        self.auto_escape = opt_ctx.auto_escape
+        self.newline = opt_ctx.newline
+        self.ancestor_classes = tuple(ancestor_classes)
+
+    def fill(self, value):
+        check = not self.recover and self.ancestor_classes
+        if isinstance(value, MarkdownFormattingObject):
+            opt_ctx = _MDTagsContext(recover=self.recover, format_md=self.format_md,
+                                     auto_escape=self.auto_escape)
+            if check:
+                self._check(value, opt_ctx)
+            text = opt_ctx.render(value)
+        else:
+            if check:
+                self.ancestor_classes[-1]._check_contents((value,))
+            text = str(value)
+            if self.auto_escape:
+                text = escape(text)
+        if check and "\n" in text:
+            for cls in self.ancestor_classes:
+                if not cls._newlines_allowed:
+                    raise IllegalMarkdownFormattingException("No newlines allowed in " + cls.__name__ +
+                                                             ", the value of " + repr(self.name) + " has one")
+        if self.newline != "\n":
+            text = text.replace("\n", self.newline)
+        return text
+
+    def _check(self, value, opt_ctx):
+        rules = _nesting_rules_for(self.format_md)
+        ancestors = 0
+        for cls in self.ancestor_classes:
+            ancestors |= rules.class_rule(cls)[0]
+        parent_class = self.ancestor_classes[-1]
+        if rules.class_rule(parent_class)[2] and not isinstance(value, MFOWrapper):
+            raise IllegalMarkdownFormattingException("You can't put markdown elements in Code elements, just text.")
+        parent_class._check_contents((value,))
+        _validate(value, ancestors, rules, opt_ctx)
+
+
+class CompiledTemplate(object):
+    # The static parts of a tree rendered once, render only fills the slots.
+    def __init__(self, parts, slots):
+        self._parts = parts
+        self._slots = slots
+        self.names = tuple(sorted(set(slot.name for (i, slot) in slots)))
+
+    def render(self, **values):
+        parts = list(self._parts)
+        for (i, slot) in self._slots:
+            try:
+                value = values[slot.name]
+            except KeyError:
+                raise KeyError("No value for template placeholder " + repr(slot.name))
+            parts[i] = slot.fill(value)
+        return "".join(parts)
 
 
 class BlockLevel(MarkdownFormattingObject):
-    pass
+    __slots__ = ("_rendered",)
 
 
 class _RepeatableBlockLevel(BlockLevel):
-    pass
+    __slots__ = ()
 
 
 class HorizontalRuleLine(BlockLevel):
+    # Has no contents or options, every HorizontalRuleLine() is the same object.
+    __slots__ = ()
+    _instance = None
+
+    def __new__(cls):
+        if cls.__dict__.get("_instance") is None:
+            cls._instance = super(HorizontalRuleLine, cls).__new__(cls)
+            MarkdownFormattingObject.__init__(cls._instance)
+        return cls._instance
+
     def __init__(self):
-        self.contents = tuple()
+        pass
 
     def __repr__(self):
         return repr(type(self))
 
-    def _check_recursive(self, banned_class_exception_tuples, opt_ctx):
-        pass
+    def _iter_markdown(self, opt_ctx):
+        yield "---" if opt_ctx.compact else "---------------------------"
 
-    def _tags_to_markdown(self, opt_ctx):
-        return "---------------------------"
+    def _iter_html(self, opt_ctx):
+        yield "<hr />"
 
 
 class Header(BlockLevel):
+    __slots__ = ("level",)
+
     def __init__(self, level, *contents):
         assert level in [1, 2, 3, 4, 5, 6]
         self.level = level
-        self.contents = contents
-        self._wrap_unwrapped()
+        super(Header, self).__init__(*contents)
 
     def __repr__(self):
-        return repr(type(self)) + self.level + "(" + repr(self.contents) + ")"
+        return repr(type(self)) + str(self.level) + "(" + repr(self.contents) + ")"
 
-    def _tags_to_markdown(self, opt_ctx):
-        return ("#" * self.level) + "".join(c._tags_to_markdown(opt_ctx) for c in self.contents)
+    def _iter_markdown(self, opt_ctx):
+        yield "#" * self.level
+        yield self.contents
+
+    def _iter_html(self, opt_ctx):
+        yield "<h" + str(self.level) + ">"
+        yield self.contents
+        yield "</h" + str(self.level) + ">"
 
 
 class Italic(MarkdownFormattingObject):
-    def _tags_to_markdown(self, opt_ctx):
-        return "*" + "".join(c._tags_to_markdown(opt_ctx) for c in self.contents) + "*"
+    __slots__ = ()
+
+    def _iter_markdown(self, opt_ctx):
+        yield "*"
+        yield self.contents
+        yield "*"
+
+    def _iter_html(self, opt_ctx):
+        yield "<em>"
+        yield self.contents
+        yield "</em>"
 
 
 class Bold(MarkdownFormattingObject):
-    def _tags_to_markdown(self, opt_ctx):
-        return "**" + "".join(c._tags_to_markdown(opt_ctx) for c in self.contents) + "**"
+    __slots__ = ()
+
+    def _iter_markdown(self, opt_ctx):
+        yield "**"
+        yield self.contents
+        yield "**"
+
+    def _iter_html(self, opt_ctx):
+        yield "<strong>"
+        yield self.contents
+        yield "</strong>"
+
+
+class Escaped(MarkdownFormattingObject):
+    # A character written with a backslash in front of it. parse keeps the
+    # escapes of the source in these, so text that isn't changed is written
+    # back as it was read, with auto_escape or without.
+    __slots__ = ()
+
+    def __init__(self, character):
+        super(Escaped, self).__init__(character)
+
+    def _iter_markdown(self, opt_ctx):
+        yield "\\" + self.contents[0]
+
+    def _iter_html(self, opt_ctx):
+        yield self.contents
 
 class _List(_RepeatableBlockLevel):
+    __slots__ = ("title",)
+    _lazy_contents = True
+
     @classmethod
     def with_title(cls, title, *contents):
         obj = cls(*contents)
@@ -143,130 +1306,588 @@ class _List(_RepeatableBlockLevel):
         self.title = ""
         super(_List, self).__init__(*contents)
 
-class UnorderedList(_List):
-    def _tags_to_markdown(self, opt_ctx):
-        res = ""
+    def _iter_markdown(self, opt_ctx):
+        if self.title:
+            # Text like the items, escaped with them.
+            yield (self.title,)
+            yield "\n\n"
+
+        if opt_ctx.compact:
+            # Items are separated instead of followed by a blank line. Only the
+            # first number of an ordered list counts.
+            for (i, list_item) in enumerate(_iter_expanded(self.contents, opt_ctx)):
+                if i:
+                    yield "\n\n"
+                yield from self._iter_item(opt_ctx, 1, list_item)
+            return
+        for (i, list_item) in enumerate(_iter_expanded(self.contents, opt_ctx), start=1):
+            yield from self._iter_item(opt_ctx, i, list_item)
+
+    def _iter_item(self, opt_ctx, i, list_item):
+        if isinstance(list_item, _List) and not list_item.title and not opt_ctx.compact:
+            yield "\n"
+        yield self._item_marker(i)
+        opt_ctx.push_prefix("    ")
+        yield opt_ctx.render_block(list_item, cacheable=False)
+        opt_ctx.pop_prefix()
+        if not opt_ctx.compact:
+            yield "\n\n"
+
+    def _iter_html(self, opt_ctx):
         if self.title:
-            res += self.title + "\n\n"
-
-        for list_item in self.contents:
-            first_line = True
-            for line in list_item._tags_to_markdown(opt_ctx).split("\n"):
-                if first_line:
-                    if isinstance(list_item, _List) and not list_item.title:
-                        res += "\n"
-                    res += "+ " + line + "\n"
-                    first_line = False
-                else:
-                    res += "    " + line + "\n"
-            res += "\n"
-        return res
+            yield "<p>"
+            yield (self.title,)
+            yield "</p>\n"
+        yield "<" + self._html_tag + ">\n"
+        for list_item in _iter_expanded(self.contents, opt_ctx):
+            yield "<li>"
+            if isinstance(list_item, _List):
+                yield list_item
+            else:
+                yield from _iter_html_flow((list_item,))
+            yield "</li>\n"
+        yield "</" + self._html_tag + ">"
+
+    def _rendered_parts(self, opt_ctx):
+        # The title joined to the first item and then every other item, each
+        # rendered once. Concatenated they are the whole list.
+        parts = [opt_ctx.render_frame(self._iter_item(opt_ctx, i, list_item))
+                 for (i, list_item) in enumerate(_iter_expanded(self.contents, opt_ctx), start=1)]
+        if opt_ctx.compact:
+            # Numbered as they are, a part can start the next string.
+            parts[:-1] = [part + "\n\n" for part in parts[:-1]]
+        if self.title:
+            title = opt_ctx.render((self.title,)) + "\n\n"
+            if parts:
+                parts[0] = title + parts[0]
+            else:
+                parts.append(title)
+        return parts
+
+class UnorderedList(_List):
+    __slots__ = ()
+    _html_tag = "ul"
+
+    def _item_marker(self, i):
+        return "+ "
 
 class OrderedList(_List):
-    def _tags_to_markdown(self, opt_ctx):
-        res = ""
-        if self.title:
-            res += self.title + "\n\n"
-
-        for (i, list_item) in enumerate(self.contents, start=1):
-            first_line = True
-            for line in list_item._tags_to_markdown(opt_ctx).split("\n"):
-                if first_line:
-                    if isinstance(list_item, _List) and not list_item.title:
-                        res += "\n"
-                    res += str(i) + ". " + line + "\n"
-                    first_line = False
-                else:
-                    res += "    " + line + "\n"
-            res += "\n"
-        return res
+    __slots__ = ()
+    _html_tag = "ol"
+
+    def _item_marker(self, i):
+        return str(i) + ". "
 
 class BlockQuote(_RepeatableBlockLevel):
-    def _tags_to_markdown(self, opt_ctx):
-        return "\n".join(">" + line
-                         for line in "".join(c._tags_to_markdown(opt_ctx)
-                                             for c in self.contents).split("\n"))
+    __slots__ = ()
+
+    def _iter_markdown(self, opt_ctx):
+        yield ">"
+        opt_ctx.push_prefix(">")
+        yield self.contents
+        opt_ctx.pop_prefix()
+
+    def _iter_html(self, opt_ctx):
+        yield "<blockquote>\n"
+        yield from _iter_html_flow(self.contents)
+        yield "</blockquote>"
 
 
 class Code(BlockLevel):
-    def _tags_to_markdown(self, opt_ctx):
-        return "\n".join("    " + x for x in
-                         "".join(self.contents, opt_ctx).split("\n"))
+    __slots__ = ()
 
-    def _check_recursive(self, banned_class_exception_tuples, opt_ctx):
-        if any(isinstance(c, MarkdownFormats) for c in self.contents):
-            raise IllegalMarkdownFormattingException("You can't put markdown elements in Code elements, just text.")
-        super(Code, self)._check_recursive(banned_class_exception_tuples, opt_ctx)
+    def _iter_markdown(self, opt_ctx):
+        auto_escape = opt_ctx.auto_escape
+        opt_ctx.auto_escape = False
+        yield "    "
+        opt_ctx.push_prefix("    ")
+        yield self.contents
+        opt_ctx.pop_prefix()
+        opt_ctx.auto_escape = auto_escape
+
+    def _iter_html(self, opt_ctx):
+        yield "<pre><code>"
+        yield self.contents
+        yield "\n</code></pre>"
 
 
 class Paragraph(BlockLevel):
-    def _tags_to_markdown(self, opt_ctx):
-        return "".join(c._tags_to_markdown(opt_ctx) for c in self.contents)
+    __slots__ = ()
+    _lazy_contents = True
+
+    def _iter_markdown(self, opt_ctx):
+        yield self.contents
+
+    def _iter_html(self, opt_ctx):
+        yield "<p>"
+        yield self.contents
+        yield "</p>"
+
+
+class Table(BlockLevel):
+    # Cells are plain values, kept per column as given and rendered a column
+    # at a time. Short columns or rows are padded with empty cells.
+    __slots__ = ("header", "columns", "align")
+
+    _align_rules = {None: "---", "left": ":--", "right": "--:", "center": ":-:"}
+    _html_align = {None: "", "left": ' align="left"', "right": ' align="right"', "center": ' align="center"'}
+
+    def __init__(self, header, rows=(), align=None):
+        self._set_columns(header, tuple(itertools.zip_longest(*rows, fillvalue="")), align)
+        super(Table, self).__init__()
+
+    @classmethod
+    def from_columns(cls, header, columns, align=None):
+        obj = cls.__new__(cls)
+        obj._set_columns(header, tuple(tuple(column) for column in columns), align)
+        MarkdownFormattingObject.__init__(obj)
+        return obj
+
+    def _set_columns(self, header, columns, align):
+        self.header = tuple(header)
+        self.columns = columns
+        width = max(len(self.header), len(columns))
+        self.align = tuple(align or ()) + (None,) * (width - len(align or ()))
+        assert all(a in self._align_rules for a in self.align)
+
+    def __repr__(self):
+        return repr(type(self)) + "(" + repr(self.header) + ", " + repr(self.columns) + ")"
+
+    def _freeze_options(self):
+        self.header = tuple(c if isinstance(c, str) else str(c) for c in self.header)
+        self.columns = tuple(tuple(c if isinstance(c, str) else str(c) for c in column) for column in self.columns)
+
+    def _check(self, opt_ctx):
+        if not self.header:
+            raise IllegalMarkdownFormattingException("Tables need at least one column")
+        if len(self.columns) > len(self.header):
+            raise IllegalMarkdownFormattingException("Table has " + str(len(self.columns)) +
+                                                     " columns but only " + str(len(self.header)) + " headers")
+        if len(self.align) > len(self.header):
+            raise IllegalMarkdownFormattingException("Table has " + str(len(self.align)) +
+                                                     " alignments but only " + str(len(self.header)) + " headers")
+
+    def _rendered_columns(self, escape_cells):
+        # Every column, header first, converted and escaped as one batch.
+        # Missing headers and columns are empty.
+        width = max(len(self.header), len(self.columns))
+        headers = itertools.chain(self.header, [""] * (width - len(self.header)))
+        bodies = itertools.chain(self.columns, [()] * (width - len(self.columns)))
+        columns = []
+        for (header, column) in zip(headers, bodies):
+            cells = [header if isinstance(header, str) else str(header)]
+            cells.extend(map(str, column))
+            columns.append(escape_cells(cells))
+        length = max(len(cells) for cells in columns) if columns else 0
+        for cells in columns:
+            cells.extend([""] * (length - len(cells)))
+        return columns
+
+    def _iter_markdown(self, opt_ctx):
+        auto_escape = opt_ctx.auto_escape
+        rows = zip(*self._rendered_columns(lambda cells: _escape_table_cells(cells, auto_escape)))
+        yield "|" + "|".join(next(rows, ())) + "|\n"
+        yield "|" + "|".join(self._align_rules[a] for a in self.align) + "|"
+        for row in rows:
+            yield "\n|" + "|".join(row) + "|"
+
+    def _iter_html(self, opt_ctx):
+        rows = zip(*self._rendered_columns(lambda cells: [_escape_html(c) for c in cells]))
+        yield "<table>\n<thead>\n<tr>"
+        for (a, cell) in zip(self.align, next(rows, ())):
+            yield "<th" + self._html_align[a] + ">" + cell + "</th>"
+        yield "</tr>\n</thead>\n<tbody>\n"
+        for row in rows:
+            yield "<tr>" + "".join("<td" + self._html_align[a] + ">" + cell + "</td>"
+                                   for (a, cell) in zip(self.align, row)) + "</tr>\n"
+        yield "</tbody>\n</table>"
+
+
+_reddit_max_table_columns = 64
+
+
+def _check_reddit_table(table, opt_ctx):
+    if len(table.header) > _reddit_max_table_columns:
+        raise IllegalMarkdownFormattingException("Reddit tables can't have more than " +
+                                                 str(_reddit_max_table_columns) + " columns")
+
+
+def _escape_table_cells(cells, auto_escape):
+    # A "|" would end the cell and a newline the row, whether or not the rest
+    # is escaped.
+    if auto_escape:
+        cells = escape_many(cells)
+    joined = "\0".join(cells)
+    if "|" not in joined and "\n" not in joined:
+        return list(cells)
+    if joined.count("\0") == len(cells) - 1:
+        return joined.replace("|", "\\|").replace("\n", " ").split("\0")
+    return [c.replace("|", "\\|").replace("\n", " ") for c in cells]
 
 
 class Link(MarkdownFormattingObject):
-    def __init__(self, url, text, title=""):
-        if title:
-            self.url = url
-            self.contents = text
-            self.title = title
-        else:
-            self.url = url
-            self.contents = text
-            self.title = None
-        self._wrap_unwrapped()
+    __slots__ = ("url", "title")
 
-    def _tags_to_markdown(self, opt_ctx):
+    def __init__(self, url, text, title=""):
+        self.url = url
+        self.title = title or None
+        super(Link, self).__init__(text)
+
+    def _iter_markdown(self, opt_ctx):
+        yield "["
+        yield self.contents
+        yield "]("
+        auto_escape = opt_ctx.auto_escape
+        opt_ctx.auto_escape = False
+        yield (self.url,)
         if self.title:
-            return ("[" + "".join(c._tags_to_markdown(opt_ctx) for c in self.contents) + "]"
-                    + "(" + self.url + ' "' + self.title + '")')
-        else:
-            return ("[" + "".join(c._tags_to_markdown(opt_ctx) for c in self.contents) + "]"
-                    + "(" + self.url + ")")
+            yield ' "'
+            yield (self.title,)
+            yield '"'
+        opt_ctx.auto_escape = auto_escape
+        yield ")"
+
+    def _iter_html(self, opt_ctx):
+        yield '<a href="'
+        yield (self.url,)
+        if self.title:
+            yield '" title="'
+            yield (self.title,)
+        yield '">'
+        yield self.contents
+        yield "</a>"
 
 
 class Image(MarkdownFormattingObject):
+    __slots__ = ("url", "title")
+
     def __init__(self, url, alt, title=""):
-        if title:
-            self.url = url
-            self.contents = alt
-            self.title = title
+        self.url = url
+        self.title = title or None
+        super(Image, self).__init__(alt)
+
+    def _iter_markdown(self, opt_ctx):
+        yield "!["
+        yield self.contents
+        yield "]("
+        auto_escape = opt_ctx.auto_escape
+        opt_ctx.auto_escape = False
+        yield (self.url,)
+        if self.title:
+            yield ' "'
+            yield (self.title,)
+            yield '"'
+        opt_ctx.auto_escape = auto_escape
+        yield ")"
+
+    def _iter_html(self, opt_ctx):
+        yield '<img src="'
+        yield (self.url,)
+        yield '" alt="'
+        yield _html_tag_pattern.sub("", opt_ctx.render(self.contents))
+        if self.title:
+            yield '" title="'
+            yield (self.title,)
+        yield '" />'
+
+
+_html_tag_pattern = re.compile("<[^>]*>")
+
+
+class _NestingRules(object):
+    # One per Dialect. Every class that may not nest in itself gets its own
+    # bit, so the ancestors of a node are a single int and checking a node is
+    # a couple of dict lookups and an and. Bits outlive reset, validation
+    # results kept on nodes are masks of them.
+    def __init__(self, dialect):
+        self.dialect = dialect
+        self.text_only_classes = (Code,)
+        self._class_rules = {}
+        self._bits = {}
+        self._next_bit = 1
+        self._masks = {}
+
+    def reset(self):
+        self._class_rules = {}
+
+    def shared_mask(self, mask):
+        # Masks are kept on many nodes and most are equal, one int each.
+        return self._masks.setdefault(mask, mask)
+
+    def class_rule(self, cls):
+        try:
+            return self._class_rules[cls]
+        except KeyError:
+            pass
+        if cls in _plain_classes:
+            # Frozen nodes nest like the nodes they were.
+            rule = self.class_rule(_plain_classes[cls])
+        elif not issubclass(cls, MarkdownFormattingObject) or issubclass(cls, (MFOWrapper, LazyContents,
+                                                                                Placeholder)):
+            rule = None
         else:
-            self.url = url
-            self.contents = alt
-            self.title = None
-        self._wrap_unwrapped()
-
-    def _check_recursive(self, banned_class_exception_tuples, opt_ctx):
-        if opt_ctx.format_md == MarkdownFormats.reddit:
-            raise IllegalMarkdownFormattingException("Reddit markdown does not allow Images")
-        super(Image, self)._check_recursive(banned_class_exception_tuples, opt_ctx)
+            if issubclass(cls, _RepeatableBlockLevel):
+                bit = 0
+            elif cls in self._bits:
+                bit = self._bits[cls]
+            else:
+                bit = self._bits[cls] = self._next_bit
+                self._next_bit <<= 1
+            banned = None
+            for (banned_cls, message) in self.dialect.banned_classes.items():
+                if issubclass(cls, banned_cls):
+                    banned = message
+            rule = (bit, banned, issubclass(cls, self.text_only_classes), self.dialect.validator(cls))
+        self._class_rules[cls] = rule
+        return rule
+
+
+def _nesting_rules_for(format_md):
+    return _dialects[format_md].rules
+
+
+class Dialect(object):
+    # What one MarkdownFormats value allows and how it writes nodes. A node
+    # class renders with its _iter_markdown/_iter_html and is checked with its
+    # _check, unless an emitter or validator is registered here for it or a
+    # base class. Both come from tables keyed on the exact class, filled for
+    # every known class whenever something is registered, so a render or
+    # validation does one dict lookup per node in any dialect. Register
+    # before rendering, results already kept on validated nodes stay.
+    def __init__(self, format_md, banned_classes=None):
+        self.format_md = format_md
+        self.banned_classes = dict(banned_classes or {})
+        self._emitters = {False: {}, True: {}}
+        self._validators = {}
+        self.rules = _NestingRules(self)
+        self._compile()
 
-    def _tags_to_markdown(self, opt_ctx):
-        if self.title:
-            return ("![" + "".join(c._tags_to_markdown(opt_ctx) for c in self.contents) + "]"
-                    + "(" + self.url + ' "' + self.title + '")')
+    def __repr__(self):
+        return "Dialect(" + str(self.format_md) + ")"
+
+    def register_emitter(self, cls, emitter, html=False):
+        # emitter(node, opt_ctx) returns what _iter_markdown (or _iter_html)
+        # would for nodes of cls and its subclasses, any iterable of chunks.
+        self._emitters[html][cls] = lambda node, opt_ctx: iter(emitter(node, opt_ctx))
+        self._compile()
+
+    def register_validator(self, cls, validator):
+        # validator(node, opt_ctx) raises IllegalMarkdownFormattingException
+        # for nodes of cls and its subclasses, after their own _check.
+        self._validators.setdefault(cls, []).append(validator)
+        self._compile()
+
+    def unregister(self, cls):
+        # Removes the emitters and validators registered for cls itself.
+        self._emitters[False].pop(cls, None)
+        self._emitters[True].pop(cls, None)
+        self._validators.pop(cls, None)
+        self._compile()
+
+    def ban(self, cls, message):
+        self.banned_classes[cls] = message
+        self._compile()
+
+    def _compile(self):
+        # New tables instead of changing them, renders going on keep theirs.
+        self.markdown_emitters = {}
+        self.html_emitters = {}
+        self.rules.reset()
+        classes = [MarkdownFormattingObject]
+        for cls in classes:
+            classes.extend(cls.__subclasses__())
+        for cls in classes + [tuple, list, types.GeneratorType]:
+            self.emitter(cls, False)
+            self.emitter(cls, True)
+            self.rules.class_rule(cls)
+
+    def emitter(self, cls, html):
+        # Looked up once per class, runs of contents of any type go through
+        # _iter_contents.
+        if issubclass(cls, MarkdownFormattingObject):
+            registered = self._emitters[html]
+            for base in cls.__mro__:
+                if base in registered:
+                    emitter = registered[base]
+                    break
+            else:
+                emitter = cls._iter_html if html else cls._iter_markdown
         else:
-            return ("![" + "".join(c._tags_to_markdown(opt_ctx) for c in self.contents) + "]"
-                    + "(" + self.url + ")")
+            emitter = _iter_contents
+        (self.html_emitters if html else self.markdown_emitters)[cls] = emitter
+        return emitter
+
+    def validator(self, cls):
+        validators = [v for base in reversed(cls.__mro__) for v in self._validators.get(base, ())]
+        check = cls._check
+        if not validators:
+            return check
+
+        def check_all(node, opt_ctx):
+            check(node, opt_ctx)
+            for validator in validators:
+                validator(node, opt_ctx)
+        return check_all
+
+
+_dialects = dict((format_md, Dialect(format_md)) for format_md in MarkdownFormats)
+
+
+def get_dialect(format_md):
+    return _dialects[format_md]
+
+
+_dialects[MarkdownFormats.reddit].ban(Image, "Reddit markdown does not allow Images")
+_dialects[MarkdownFormats.new_reddit].ban(Image, "Reddit markdown does not allow Images")
+_dialects[MarkdownFormats.commonmark].ban(Table, "CommonMark has no tables, use MarkdownFormats.gfm")
+_dialects[MarkdownFormats.reddit].register_validator(Table, _check_reddit_table)
+_dialects[MarkdownFormats.new_reddit].register_validator(Table, _check_reddit_table)
+
+
+def _validate(node, ancestors, rules, opt_ctx):
+    # Returns the bits of every non-repeatable class in the subtree. They are
+    # remembered per format on the nodes a later validation can meet again:
+    # the node validation started at, blocks and frozen nodes. A subtree that
+    # already passed only has to be compared against its new ancestors, an
+    # inline node is checked again with the rest of its block.
+    # Walks the tree with its own stack of [node, ancestors with node's bit,
+    # subtree mask, contents iterator, stats, has LazyContents] so nesting
+    # depth isn't limited by the recursion limit. LazyContents runs and
+    # Placeholders only remember their ancestors here, the subtrees around
+    # them aren't remembered as validated.
+    format_md = opt_ctx.format_md
+    stats = opt_ctx.stats
+    stack = []
+    while True:
+        rule = rules.class_rule(type(node))
+        mask = 0 if rule is None else _validated_mask(node, ancestors, format_md)
+        if mask is None:
+            if stats is not None:
+                timing = (stats.clock(), stats._validation_child_time)
+                stats._validation_child_time = 0.0
+            else:
+                timing = None
+            (bit, banned, text_only, check) = rule
+            if bit & ancestors:
+                raise IllegalMarkdownFormattingException("Illegal nested MarkdownFormattingTags class " +
+                                                         str(type(node)))
+            if banned:
+                raise IllegalMarkdownFormattingException(banned)
+            if text_only and not all(isinstance(c, (str, MFOWrapper, Placeholder)) for c in node.contents):
+                raise IllegalMarkdownFormattingException("You can't put markdown elements in Code elements, just text.")
+            check(node, opt_ctx)
+            stack.append([node, ancestors | bit, bit, iter(node.contents), timing, False])
+        elif stack:
+            stack[-1][2] |= mask
+            if isinstance(node, LazyContents):
+                node._ancestors[format_md] = (ancestors, type(stack[-1][0]))
+                stack[-1][5] = True
+            elif isinstance(node, Placeholder):
+                node._ancestors[format_md] = tuple(_plain_type(frame[0]) for frame in stack)
+                stack[-1][5] = True
+        else:
+            return mask
+
+        while stack:
+            frame = stack[-1]
+            for node in frame[3]:
+                if not isinstance(node, str):
+                    break
+            else:
+                stack.pop()
+                mask = _finish_validation(frame, format_md, stats, not stack)
+                if not stack:
+                    return mask
+                stack[-1][2] |= mask
+                stack[-1][5] |= frame[5]
+                continue
+            ancestors = frame[1]
+            break
+
+
+def _validated_mask(node, ancestors, format_md):
+    mask = _kept(node, format_md)
+    if mask is not None and not mask & ancestors:
+        return mask
+    return None
+
+
+def _finish_validation(frame, format_md, stats, root):
+    (node, ancestors, mask, contents, timing, has_lazy) = frame
+    if not has_lazy and (root or isinstance(node, BlockLevel) or node.frozen):
+        _keep(node, format_md, _nesting_rules_for(format_md).shared_mask(mask))
+
+    if timing is not None:
+        (start, outer_child_time) = timing
+        elapsed = stats.clock() - start
+        entry = stats._entry(_plain_type(node))
+        entry.validations += 1
+        entry.validation_time += elapsed - stats._validation_child_time
+        stats._validation_child_time = outer_child_time + elapsed
+    return mask
+
+
+# _validated holds what validation and measuring keep on a node: masks per
+# format, TextMetrics per render options and the structure key of frozen
+# nodes. Most nodes keep one entry or none, a single entry is a (key, value)
+# pair, a dict only holds two or more.
+def _kept(node, key):
+    validated = node._validated
+    if type(validated) is tuple:
+        return validated[1] if validated[0] == key else None
+    if validated is None:
+        return None
+    return validated.get(key)
+
+
+def _keep(node, key, value):
+    validated = node._validated
+    if validated is None or (type(validated) is tuple and validated[0] == key):
+        node._validated = (key, value)
+    elif type(validated) is tuple:
+        node._validated = {validated[0]: validated[1], key: value}
+    else:
+        validated[key] = value
+
+
+def _escape_html(string):
+    # html.escape, without importing html and its entity tables.
+    if "&" in string:
+        string = string.replace("&", "&amp;")
+    return (string.replace("<", "&lt;").replace(">", "&gt;")
+            .replace('"', "&quot;").replace("'", "&#x27;"))
 
 
 _escaped_characters = list(r"\`*_{}[]()#+-.!")
 _replace_map = [(e, "\\" + e) for e in _escaped_characters]
+_needs_escape = re.compile("[" + re.escape("".join(_escaped_characters)) + "]")
 
 
 def escape_strings(content):
-    if isinstance(content, basestring):
+    if isinstance(content, _string_types):
         return escape(content)
     return content
 
 
 def escape(string):
+    # One scan decides whether anything needs escaping, then only the
+    # characters that actually occur are replaced ("\\" first).
+    if _needs_escape.search(string) is None:
+        return string
     for (o, n) in _replace_map:
-        string = string.replace(o, n)
+        if o in string:
+            string = string.replace(o, n)
     return string
 
 
-def _prepend_to_each_line(first_pre, other_pre, content):
-    "\n".join((other_pre + s for s in content.split("\n")))
-
+def escape_many(strings):
+    # Escapes the whole batch joined on a separator in one call instead of one
+    # call per string, unless a string contains the separator itself.
+    strings = list(strings)
+    joined = "\0".join(strings)
+    if joined.count("\0") != max(len(strings) - 1, 0):
+        return [escape(string) for string in strings]
+    escaped = escape(joined)
+    if escaped is joined:
+        return strings
+    return escaped.split("\0")
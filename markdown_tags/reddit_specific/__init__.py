@@ -1,4 +1,4 @@
-from reddit_specific import *
+from .reddit_specific import *
 
 __author__ = "Roman A. Taycher"
 __copyright__ = "Copyright 2014, Roman A. Taycher"
@@ -6,3 +6,11 @@ __credits__ = ["Roman A. Taycher"]
 __license__ = "MIT"
 __maintainer__ = "Roman A. Taycher"
 __email__ = "rtaycher1987@gmail.com"
+
+
+def __getattr__(name):
+    # movies_subreddit is only imported when first used.
+    if name != "movies_subreddit":
+        raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+    import importlib
+    return importlib.import_module(".movies_subreddit", __name__)
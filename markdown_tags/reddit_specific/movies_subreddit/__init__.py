@@ -1,4 +1,4 @@
-from movies_subreddit import *
+from .movies_subreddit import *
 
 __author__ = "Roman A. Taycher"
 __copyright__ = "Copyright 2014, Roman A. Taycher"
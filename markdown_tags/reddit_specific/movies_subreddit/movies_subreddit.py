@@ -3,12 +3,43 @@ from markdown_tags import *
 
 
 class Spoiler(MarkdownFormattingObject):
+    __slots__ = ()
+
     def __init__(self, visible, spoiler):
-        self.contents = (visible, spoiler)
-        self.visible = visible
-        self.spoiler = spoiler
-        self._wrap_unwrapped()
+        super(Spoiler, self).__init__(visible, spoiler)
+
+    @property
+    def visible(self):
+        return self.contents[0]
+
+    @property
+    def spoiler(self):
+        return self.contents[1]
+
+    def _iter_markdown(self, opt_ctx):
+        yield "["
+        yield self.contents[:1]
+        yield '](#s "'
+        auto_escape = opt_ctx.auto_escape
+        opt_ctx.auto_escape = False
+        yield self.contents[1:]
+        opt_ctx.auto_escape = auto_escape
+        yield '")'
+
+    def _iter_html(self, opt_ctx):
+        yield '<a href="#s" title="'
+        yield self.contents[1:]
+        yield '">'
+        yield self.contents[:1]
+        yield "</a>"
+
+
+def _iter_new_reddit_spoiler(spoiler, opt_ctx):
+    # New reddit has spoilers of its own, the visible text is written before.
+    yield spoiler.contents[:1]
+    yield " >!"
+    yield spoiler.contents[1:]
+    yield "!<"
 
-    def _tags_to_markdown(self, opt_ctx):
-        return '[' + self.visible + '](#s "' + self.spoiler + '")'
 
+get_dialect(MarkdownFormats.new_reddit).register_emitter(Spoiler, _iter_new_reddit_spoiler)
@@ -10,16 +10,74 @@ reddiquette_link = markdown_tags.Link("reddiquette", "http://www.reddit.com/wiki
 
 
 class Strikethrough(markdown_tags.MarkdownFormattingObject):
-    def _tags_to_markdown(self, opt_ctx):
-        return "~~" + "".join(c._tags_to_markdown(opt_ctx) for c in self.contents) + "~~"
+    __slots__ = ()
+
+    def _iter_markdown(self, opt_ctx):
+        yield "~~"
+        yield self.contents
+        yield "~~"
+
+    def _iter_html(self, opt_ctx):
+        yield "<del>"
+        yield self.contents
+        yield "</del>"
 
 
 class Superscript(markdown_tags.MarkdownFormattingObject):
-    def _tags_to_markdown(self, opt_ctx):
-        return  "^(" + "".join(c._tags_to_markdown(opt_ctx) for c in self.contents) + ")"
+    __slots__ = ()
+    _newlines_allowed = False
+
+    def _iter_markdown(self, opt_ctx):
+        # Already rendered when _check measured it.
+        measured = opt_ctx.take_measured(self)
+        if measured is not None:
+            yield measured
+            return
+        yield "^("
+        yield self.contents
+        yield ")"
+
+    def _iter_html(self, opt_ctx):
+        measured = opt_ctx.take_measured(self)
+        if measured is not None:
+            yield measured
+            return
+        yield "<sup>"
+        yield self.contents
+        yield "</sup>"
 
-    def _check_recursive(self, banned_class_exception_tuples, opt_ctx):
+    def _check(self, opt_ctx):
         if any(isinstance(c,markdown_tags.BlockLevel) for c in self.contents):
             raise markdown_tags.IllegalMarkdownFormattingException("No BlockLevel tags allowed in superscipt.")
-        if "\n" in "".join(c._tags_to_markdown(opt_ctx) for c in self.contents):
-            raise markdown_tags.IllegalMarkdownFormattingException("No spaces allowed in superscipt.")
\ No newline at end of file
+        # Placeholders can't be rendered before CompiledTemplate.render fills
+        # them in, which checks their values for newlines. Only the text
+        # around them is checked here.
+        texts = _texts_unless_placeholder(self)
+        if texts is None:
+            newline = opt_ctx.metrics(self).newline
+        else:
+            newline = any("\n" in text for text in texts)
+        if newline:
+            raise markdown_tags.IllegalMarkdownFormattingException("No spaces allowed in superscipt.")
+
+
+def _texts_unless_placeholder(node):
+    # The text in node's subtree if it has a Placeholder, otherwise None.
+    texts = []
+    placeholder = False
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            texts.append(node)
+        elif isinstance(node, markdown_tags.MFOWrapper):
+            texts.append(str(node.contents))
+        else:
+            placeholder = placeholder or isinstance(node, markdown_tags.Placeholder)
+            stack.extend(node.contents)
+    return texts if placeholder else None
+
+
+markdown_tags.get_dialect(markdown_tags.MarkdownFormats.commonmark).ban(Strikethrough, "CommonMark has no strikethrough")
+markdown_tags.get_dialect(markdown_tags.MarkdownFormats.commonmark).ban(Superscript, "CommonMark has no superscript")
+markdown_tags.get_dialect(markdown_tags.MarkdownFormats.gfm).ban(Superscript, "GFM has no superscript")
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+#
+import importlib
+import mmap
+import struct
+
+from .markdown_tags import CompiledTemplate, MarkdownFormats, _MDTagsContext, _TemplateSlot
+
+# Layout, all little endian:
+#   header    magic, format version, template count, offset of the index
+#   templates one after another, each a run of segments
+#   names     utf-8 template names
+#   index     one entry per template sorted by name bytes:
+#             name offset, name length, template offset, template length
+# A segment is a literal (kind 0, length, utf-8 text) or a slot (kind 1,
+# name, flags, format, newline, ancestor classes as "module:qualname"), each
+# length prefixed.
+_magic = b"MDTB"
+_format_version = 2
+_header = struct.Struct("<4sHHIQ")
+_index_entry = struct.Struct("<QIQI")
+_literal = struct.Struct("<BI")
+_slot = struct.Struct("<BHBBIH")
+_class_name = struct.Struct("<H")
+_recover_flag = 1
+_auto_escape_flag = 2
+_formats = list(MarkdownFormats)
+
+
+def write_template_bundle(fp, templates):
+    # Writes a mapping of name to CompiledTemplate (from MD.compile) to fp, a
+    # path or a binary file.
+    if isinstance(fp, str):
+        with open(fp, "wb") as f:
+            return write_template_bundle(f, templates)
+    names = sorted((name.encode("utf-8"), template) for (name, template) in templates.items())
+    offset = _header.size
+    fp.write(b"\0" * _header.size)
+    locations = []
+    for (name, template) in names:
+        data = _encode_template(template)
+        fp.write(data)
+        locations.append((offset, len(data)))
+        offset += len(data)
+    index = []
+    for ((name, template), (data_offset, data_length)) in zip(names, locations):
+        fp.write(name)
+        index.append(_index_entry.pack(offset, len(name), data_offset, data_length))
+        offset += len(name)
+    fp.write(b"".join(index))
+    fp.seek(0)
+    fp.write(_header.pack(_magic, _format_version, 0, len(names), offset))
+
+
+def _encode_template(template):
+    slots = dict(template._slots)
+    segments = []
+    for (i, part) in enumerate(template._parts):
+        if part is not None:
+            text = part.encode("utf-8")
+            segments.append(_literal.pack(0, len(text)) + text)
+            continue
+        slot = slots[i]
+        name = slot.name.encode("utf-8")
+        newline = slot.newline.encode("utf-8")
+        flags = (_recover_flag if slot.recover else 0) | (_auto_escape_flag if slot.auto_escape else 0)
+        segments.append(_slot.pack(1, len(name), flags, _formats.index(slot.format_md), len(newline),
+                                   len(slot.ancestor_classes)) + name + newline)
+        for cls in slot.ancestor_classes:
+            class_name = (cls.__module__ + ":" + cls.__qualname__).encode("utf-8")
+            segments.append(_class_name.pack(len(class_name)) + class_name)
+    return b"".join(segments)
+
+
+def _load_class(class_name):
+    (module_name, qualname) = class_name.split(":")
+    obj = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        obj = getattr(obj, name)
+    return obj
+
+
+class TemplateBundle(object):
+    # A template bundle file mapped into memory. Opening it only reads the
+    # header, a template is found by binary search in the index and decoded
+    # the first time it is used. The pages are shared by every process that
+    # maps the same file.
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _header.size:
+            self.close()
+            raise ValueError(path + " is not a markdown_tags template bundle")
+        (magic, version, reserved, self._count, self._index_offset) = _header.unpack_from(self._mmap, 0)
+        if magic != _magic:
+            self.close()
+            raise ValueError(path + " is not a markdown_tags template bundle")
+        if version != _format_version:
+            self.close()
+            raise ValueError(path + " is a version " + str(version) + " template bundle, expected version " +
+                             str(_format_version))
+        self._templates = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._templates = {}
+        self._mmap.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, name):
+        return self._find(name.encode("utf-8")) is not None
+
+    def __getitem__(self, name):
+        try:
+            return self._templates[name]
+        except KeyError:
+            pass
+        location = self._find(name.encode("utf-8"))
+        if location is None:
+            raise KeyError("No template " + repr(name) + " in bundle")
+        template = self._templates[name] = self._decode(*location)
+        return template
+
+    def names(self):
+        for i in range(self._count):
+            (name_offset, name_length, data_offset, data_length) = self._entry(i)
+            yield self._mmap[name_offset:name_offset + name_length].decode("utf-8")
+
+    def render(self, name, **values):
+        return self[name].render(**values)
+
+    def _entry(self, i):
+        return _index_entry.unpack_from(self._mmap, self._index_offset + i * _index_entry.size)
+
+    def _find(self, name):
+        low = 0
+        high = self._count
+        while low < high:
+            middle = (low + high) // 2
+            (name_offset, name_length, data_offset, data_length) = self._entry(middle)
+            found = self._mmap[name_offset:name_offset + name_length]
+            if found == name:
+                return (data_offset, data_length)
+            if found < name:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def _decode(self, offset, length):
+        data = self._mmap
+        end = offset + length
+        parts = []
+        slots = []
+        while offset < end:
+            if data[offset] == 0:
+                (kind, text_length) = _literal.unpack_from(data, offset)
+                offset += _literal.size
+                parts.append(data[offset:offset + text_length].decode("utf-8"))
+                offset += text_length
+                continue
+            (kind, name_length, flags, format_index, newline_length, class_count) = _slot.unpack_from(data, offset)
+            offset += _slot.size
+            name = data[offset:offset + name_length].decode("utf-8")
+            offset += name_length
+            opt_ctx = _MDTagsContext(recover=bool(flags & _recover_flag), format_md=_formats[format_index],
+                                     auto_escape=bool(flags & _auto_escape_flag))
+            opt_ctx.newline = data[offset:offset + newline_length].decode("utf-8")
+            offset += newline_length
+            ancestor_classes = []
+            for i in range(class_count):
+                (class_name_length,) = _class_name.unpack_from(data, offset)
+                offset += _class_name.size
+                ancestor_classes.append(_load_class(data[offset:offset + class_name_length].decode("utf-8")))
+                offset += class_name_length
+            slots.append((len(parts), _TemplateSlot(name, opt_ctx, ancestor_classes)))
+            parts.append(None)
+        return CompiledTemplate(parts, slots)
@@ -10,8 +10,13 @@ import sys
 import zipfile
 import subprocess
 import shutil
-import urllib
+import urllib.request
 import stat
+import io
+import array
+import copy
+import re
+import time
 
 sys.path.append("../..")
 
@@ -77,7 +82,7 @@ def download_markdown_if_needed():
             raise
 
         try:
-            urllib.urlretrieve(discount_zip_url, local_discount_zip_path)
+            urllib.request.urlretrieve(discount_zip_url, local_discount_zip_path)
         except Exception as ex:
             print("Markdown implementation Discount binary not found and could not be downloaded:")
             raise
@@ -123,14 +128,26 @@ def context(*extra_ctx):
 def compile_markdown(markdown_txt):
     download_markdown_if_needed()
     with tempfile.NamedTemporaryFile() as src:
-        src.write(markdown_txt)
+        src.write(markdown_txt.encode("utf-8"))
         src.flush()
         with tempfile.NamedTemporaryFile() as output_file:
             subprocess.check_call([markdown_discount_binary, "-o", output_file.name, src.name])
-            html_generated = output_file.read()
+            html_generated = output_file.read().decode("utf-8")
             return html_generated
 
 
+def compact_corpus():
+    # Nodes every format allows, nested the ways compact output changes.
+    return m.MD(m.Header(2, "Summary"),
+                m.Paragraph("Hello ", m.Bold(m.Italic("user")), ", see ", m.Link("http://example.com", "the wiki")),
+                m.UnorderedList("first", m.UnorderedList("nested a", "nested b"),
+                                m.OrderedList.with_title("Steps", *["step %d" % i for i in range(12)])),
+                m.HorizontalRuleLine(),
+                m.BlockQuote(m.Paragraph("quoted"), m.UnorderedList("q1", m.UnorderedList("q2"))),
+                m.OrderedList(*["item %d" % i for i in range(15)]),
+                m.Paragraph("the end"))
+
+
 class Test_MarkdownTagsComplicated(unittest.TestCase):
     def test_bold_italic_text(self):
         tags = m.MD(m.Paragraph(m.Bold(m.Italic("This is important!!!"))))
@@ -193,6 +210,15 @@ class Test_MarkdownTagsComplicated(unittest.TestCase):
                     #TODO insert a few more checks
 
 
+    def test_compact_renders_same_html(self):
+        tags = compact_corpus()
+        for format_md in m.MarkdownFormats:
+            with context("format_md:", format_md):
+                html = [re.sub(r">\s+<", "><", compile_markdown(tags.tags_to_markdown(False, format_md, compact=compact)))
+                        for compact in (False, True)]
+                self.assertEqual(html[0], html[1])
+
+
 class Test_MarkdownTagsSingle(unittest.TestCase):
     def test_paragraphs(self):
         tags = m.MD(*[m.Paragraph(s) for s in ["First", "Security", "Tree"]])
@@ -325,6 +351,1028 @@ class Test_RedditMarkdown(unittest.TestCase):
                     self.assertEqual("colour", html("del").text())
 
 
+class Test_MarkdownTagsStreaming(unittest.TestCase):
+    def setUp(self):
+        self.tags = m.MD(m.Header(1, "Digest"),
+                         m.UnorderedList.with_title("Posts",
+                                                    m.OrderedList("A", m.Bold("B")),
+                                                    m.Link("example.com", "C")),
+                         m.BlockQuote(m.Paragraph("quoted\ntext")),
+                         m.Paragraph(rmd.Strikethrough("old"), rmd.Superscript("new")))
+
+    def test_iter_markdown_matches_tags_to_markdown(self):
+        markdown_str = self.tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+        chunks = list(self.tags.iter_markdown(recover=False, format_md=m.MarkdownFormats.reddit))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(markdown_str, "".join(chunks))
+
+    def test_write_markdown(self):
+        out = io.StringIO()
+        self.tags.write_markdown(out, recover=False, format_md=m.MarkdownFormats.reddit)
+        self.assertEqual(self.tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit),
+                         out.getvalue())
+
+    def test_iter_markdown_validates_before_first_chunk(self):
+        tags = m.MD(m.Paragraph(m.Image("./pic1", "pic 1")))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            tags.iter_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+
+
+class Test_MarkdownTagsNesting(unittest.TestCase):
+    def test_nested_list_indentation(self):
+        tags = m.MD(m.UnorderedList.with_title("Outline",
+                                               m.OrderedList.with_title("Needs", "Air", "Water"),
+                                               "Research"))
+        markdown_str = tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+        self.assertEqual("Outline\n\n"
+                         "+ Needs\n    \n    1. Air\n    \n    2. Water\n    \n    \n\n"
+                         "+ Research\n\n", markdown_str)
+
+    def test_quote_inside_list(self):
+        tags = m.MD(m.UnorderedList(m.BlockQuote(m.Paragraph("one\ntwo"))))
+        markdown_str = tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+        self.assertEqual("+ >one\n    >two\n\n", markdown_str)
+
+    def test_code_lines_are_indented(self):
+        tags = m.MD(m.Code("x = 1\ny = 2"))
+        markdown_str = tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.basic)
+        self.assertEqual("    x = 1\n    y = 2", markdown_str)
+
+
+class Test_MarkdownTagsValidation(unittest.TestCase):
+    def check(self, tags, format_md=m.MarkdownFormats.reddit):
+        return tags.tags_to_markdown(recover=False, format_md=format_md)
+
+    def test_non_repeatable_nesting(self):
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.check(m.MD(m.Paragraph(m.Bold(m.Italic(m.Bold("B"))))))
+        self.check(m.MD(m.Paragraph(m.Bold("B"), m.Bold("C"))))
+        self.check(m.MD(m.UnorderedList(m.UnorderedList(m.BlockQuote(m.BlockQuote("q"))))))
+
+    def test_code_is_text_only(self):
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.check(m.MD(m.Code(m.Bold("x"))))
+
+    def test_second_level_must_be_block(self):
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.check(m.MD(m.Bold("x")))
+
+    def test_superscript_rules_apply_below_it(self):
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.check(m.MD(m.Paragraph(rmd.Superscript("a\nb"))))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.check(m.MD(m.Paragraph(rmd.Superscript(m.Italic(m.Italic("i"))))))
+
+    def test_shared_subtree_checked_against_new_ancestors(self):
+        shared = m.Italic(m.Bold("shared"))
+        self.check(m.MD(m.Paragraph(shared), m.Paragraph(shared)))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.check(m.MD(m.Paragraph(m.Bold(shared))))
+
+    def test_results_are_kept_on_blocks_and_frozen_nodes(self):
+        (bold, italic) = (m.Bold("b"), m.Italic("i").freeze())
+        paragraph = m.Paragraph(bold, italic)
+        self.check(m.MD(paragraph))
+        for (tags, validated) in [(m.MD(paragraph), []), (m.MD(m.Paragraph(bold, italic)), [m.Paragraph, m.Bold])]:
+            stats = m.RenderStats()
+            tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit, stats=stats)
+            self.assertEqual(sorted([m.MD] + validated, key=repr),
+                             sorted((cls for (cls, entry) in stats.by_class.items() if entry.validations), key=repr))
+
+    def test_image_allowed_only_outside_reddit(self):
+        tags = m.MD(m.Paragraph(m.Image("./pic1", "pic 1")))
+        self.check(tags, m.MarkdownFormats.basic)
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.check(tags, m.MarkdownFormats.reddit)
+
+
+class Test_Escape(unittest.TestCase):
+    def test_escape(self):
+        self.assertEqual(r"a\*b\_\[c\]\(d\)\\", m.escape("a*b_[c](d)\\"))
+        self.assertEqual("plain text", m.escape("plain text"))
+
+    def test_escape_many(self):
+        self.assertEqual([r"user\_1", "user2", ""], m.escape_many(iter(["user_1", "user2", ""])))
+        self.assertEqual(["x\0\\*", "y"], m.escape_many(["x\0*", "y"]))
+        self.assertEqual([], m.escape_many([]))
+
+    def test_escape_strings(self):
+        self.assertEqual(r"\#1", m.escape_strings("#1"))
+        self.assertEqual(1, m.escape_strings(1))
+
+    def test_auto_escape(self):
+        tags = m.MD(m.Paragraph(m.Bold("2*3"), " #1 ", m.Link("http://a.com/x_y", "[x]")), m.Code("a*b"))
+        self.assertEqual("**2\\*3** \\#1 [\\[x\\]](http://a.com/x_y)\n\n    a*b",
+                         tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit,
+                                               auto_escape=True))
+        self.assertEqual("**2*3** #1 [[x]](http://a.com/x_y)\n\n    a*b",
+                         tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit))
+
+    def test_auto_escape_list_titles(self):
+        tags = m.MD(m.UnorderedList.with_title("posts_by *me*", "x_1"))
+        expected = "posts\\_by \\*me\\*\n\n+ x\\_1\n\n"
+        self.assertEqual(expected, tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit,
+                                                         auto_escape=True))
+        self.assertEqual([expected], tags.split_to_limit(100, format_md=m.MarkdownFormats.reddit, auto_escape=True))
+
+
+class Test_MarkdownTagsRepresentation(unittest.TestCase):
+    def test_strings_are_stored_directly(self):
+        paragraph = m.Paragraph("a", m.Bold("b"), 3)
+        self.assertEqual("a", paragraph.contents[0])
+        self.assertIsInstance(paragraph.contents[2], m.MFOWrapper)
+        self.assertEqual("a**b**3", m.MD(paragraph).tags_to_markdown(recover=False,
+                                                                     format_md=m.MarkdownFormats.reddit))
+
+    def test_nodes_have_no_instance_dict(self):
+        for node in [m.Paragraph("a"), m.Header(1, "h"), m.UnorderedList.with_title("t", "a"),
+                     m.Link("example.com", "e"), m.Image("./pic", "p"), rmd.Superscript("s")]:
+            self.assertFalse(hasattr(node, "__dict__"), type(node))
+
+    def test_horizontal_rule_is_shared(self):
+        self.assertIs(m.HorizontalRuleLine(), m.HorizontalRuleLine())
+
+
+class Test_RenderCache(unittest.TestCase):
+    def make_footer(self):
+        return m.Paragraph("footer ", rmd.Superscript("I am a bot"), rmd.reddiquette_link)
+
+    def test_repeated_blocks_are_hits(self):
+        cache = m.RenderCache()
+        footer = self.make_footer().freeze()
+        for text in ["first", "second", "third"]:
+            tags = m.MD(m.Paragraph(text), footer, m.HorizontalRuleLine())
+            self.assertEqual(tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit),
+                             tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit,
+                                                   cache=cache))
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(footer, self.make_footer())
+
+    def test_only_frozen_blocks_are_cached(self):
+        cache = m.RenderCache()
+        for i in range(2):
+            m.MD(self.make_footer(), self.make_footer().freeze()).tags_to_markdown(
+                recover=False, format_md=m.MarkdownFormats.reddit, cache=cache)
+        # Equal frozen blocks that aren't the same object have their own entry.
+        self.assertEqual((0, 2), (cache.hits, cache.misses))
+
+    def test_options_are_part_of_the_key(self):
+        cache = m.RenderCache()
+        tags = m.MD(m.Paragraph("a*b").freeze())
+        tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit, cache=cache)
+        self.assertEqual("a\\*b", tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit,
+                                                         auto_escape=True, cache=cache))
+        self.assertEqual(0, cache.hits)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = m.RenderCache(maxsize=2)
+        paragraphs = dict((text, m.Paragraph(text).freeze()) for text in "abc")
+        for text in ["a", "b", "a", "c", "a", "b"]:
+            m.MD(paragraphs[text]).tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit,
+                                                    cache=cache)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(4, cache.misses)
+
+
+class Test_CompiledTemplate(unittest.TestCase):
+    def make_tags(self, user, item, quote):
+        return m.MD(m.Header(2, "Hi ", user),
+                    m.OrderedList(m.Link("http://example.com/u", "profile"), m.UnorderedList(item, m.Bold("x"))),
+                    m.BlockQuote(m.Paragraph(quote)))
+
+    def test_render_matches_tags_to_markdown(self):
+        template = self.make_tags(m.Placeholder("user"), m.Placeholder("item"),
+                                  m.Placeholder("quote")).compile(format_md=m.MarkdownFormats.reddit)
+        self.assertEqual(("item", "quote", "user"), template.names)
+        for (user, item, quote) in [("a_b", "x*y", "line1\nline2"), ("c", m.Italic("i\nj"), "[q]")]:
+            expected = self.make_tags(user, item, quote).tags_to_markdown(
+                recover=False, format_md=m.MarkdownFormats.reddit, auto_escape=True)
+            self.assertEqual(expected, template.render(user=user, item=item, quote=quote))
+
+    def test_placeholder_as_link_url_is_not_escaped(self):
+        template = m.MD(m.Paragraph(m.Link(m.Placeholder("url"), m.Placeholder("text")))).compile(
+            format_md=m.MarkdownFormats.reddit)
+        self.assertEqual("[a\\_b](http://example.com/a_b)", template.render(url="http://example.com/a_b", text="a_b"))
+
+    def test_missing_value(self):
+        template = m.MD(m.Paragraph(m.Placeholder("name"))).compile(format_md=m.MarkdownFormats.reddit)
+        with self.assertRaises(KeyError):
+            template.render()
+
+    def test_values_are_checked_against_their_ancestors(self):
+        code = m.MD(m.Code(m.Placeholder("code"))).compile(format_md=m.MarkdownFormats.reddit)
+        self.assertEqual("    a_b", code.render(code="a_b"))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            code.render(code=m.Bold("b"))
+        bold = m.MD(m.Paragraph(m.Bold(m.Placeholder("text")))).compile(format_md=m.MarkdownFormats.reddit)
+        self.assertEqual("***y***", bold.render(text=m.Italic("y")))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            bold.render(text=m.Bold("y"))
+
+    def test_placeholder_in_superscript(self):
+        template = m.MD(m.Paragraph(rmd.Superscript("by ", m.Placeholder("user")))).compile(
+            format_md=m.MarkdownFormats.reddit)
+        self.assertEqual("^(by some\\_user)", template.render(user="some_user"))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            template.render(user="two\nlines")
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            template.render(user=m.Bold("two\nlines"))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            m.MD(m.Paragraph(rmd.Superscript("by\n", m.Placeholder("user")))).compile(
+                format_md=m.MarkdownFormats.reddit)
+
+    def test_placeholder_needs_compile(self):
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            m.MD(m.Paragraph(m.Placeholder("name"))).tags_to_markdown(recover=False,
+                                                                      format_md=m.MarkdownFormats.reddit)
+
+
+class Test_RenderMany(unittest.TestCase):
+    def make_trees(self, count):
+        return [m.MD(m.Header(3, "Post ", str(i)),
+                     m.Paragraph("by ", m.Bold("user_" + str(i)), " ", rmd.Superscript("bot")),
+                     m.OrderedList(*["item %d" % j for j in range(i % 7)] or ["none"]),
+                     m.HorizontalRuleLine())
+                for i in range(count)]
+
+    def test_in_order(self):
+        trees = self.make_trees(100)
+        expected = [t.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit) for t in trees]
+        self.assertEqual(expected, m.render_many(trees, m.MarkdownFormats.reddit, recover=False,
+                                                 workers=2, chunksize=7))
+
+    def test_as_completed(self):
+        trees = self.make_trees(100)
+        expected = [t.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit) for t in trees]
+        rendered = m.render_many(trees, m.MarkdownFormats.reddit, recover=False, workers=2, ordered=False)
+        self.assertEqual(expected, [markdown_str for (i, markdown_str) in sorted(rendered)])
+
+    def test_small_batch_in_process(self):
+        trees = self.make_trees(3)
+        self.assertEqual([t.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit) for t in trees],
+                         m.render_many(trees, m.MarkdownFormats.reddit, recover=False, workers=4))
+
+    def test_errors_are_raised(self):
+        trees = [m.MD(m.Paragraph(m.Image("./pic1", "pic 1")))] * 100
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            m.render_many(trees, m.MarkdownFormats.reddit, recover=False, workers=2)
+
+
+class CountingParagraph(m.Paragraph):
+    __slots__ = ()
+    renders = 0
+
+    def _iter_markdown(self, opt_ctx):
+        CountingParagraph.renders += 1
+        return super(CountingParagraph, self)._iter_markdown(opt_ctx)
+
+
+class Test_IncrementalRendering(unittest.TestCase):
+    def render(self, tags):
+        return tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit, incremental=True)
+
+    def full_render(self, tags):
+        return tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+
+    def setUp(self):
+        CountingParagraph.renders = 0
+        self.tags = m.MD(CountingParagraph("score: 0"),
+                         m.OrderedList(CountingParagraph("first goal"), CountingParagraph("second goal")),
+                         CountingParagraph("footer"))
+        self.render(self.tags)
+        self.assertEqual(4, CountingParagraph.renders)
+        CountingParagraph.renders = 0
+
+    def test_unchanged_document_is_not_rendered_again(self):
+        markdown_str = self.render(self.tags)
+        self.assertEqual(0, CountingParagraph.renders)
+        self.assertEqual(self.full_render(self.tags), markdown_str)
+
+    def test_replace_only_renders_the_new_block(self):
+        self.tags.replace(0, CountingParagraph("score: 1"))
+        markdown_str = self.render(self.tags)
+        self.assertEqual(1, CountingParagraph.renders)
+        self.assertEqual(self.full_render(self.tags), markdown_str)
+
+    def test_insert_into_ordered_list_keeps_numbering(self):
+        old_list = self.tags.contents[1]
+        self.tags.insert(1, 0, CountingParagraph("opening goal"))
+        markdown_str = self.render(self.tags)
+        self.assertEqual(1, CountingParagraph.renders)
+        self.assertIn("1. opening goal", markdown_str)
+        self.assertIn("3. second goal", markdown_str)
+        self.assertEqual(self.full_render(self.tags), markdown_str)
+        self.assertEqual(2, len(old_list.contents))
+
+    def test_nested_replace_and_append(self):
+        self.tags.replace((1, 1), CountingParagraph("second goal (pen)"))
+        self.tags.append(m.Paragraph("full time"))
+        markdown_str = self.render(self.tags)
+        self.assertEqual(1, CountingParagraph.renders)
+        self.assertTrue(markdown_str.endswith("footer\n\nfull time"))
+        self.assertEqual(self.full_render(self.tags), markdown_str)
+
+    def test_edits_are_validated(self):
+        self.tags.append(m.Bold("not a block"))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.render(self.tags)
+
+
+class Test_SplitToLimit(unittest.TestCase):
+    def setUp(self):
+        self.tags = m.MD(m.Header(2, "Box office"),
+                         m.OrderedList.with_title("Weekend", *["Movie number %d: $%d" % (i, i * 1000)
+                                                               for i in range(1, 31)]),
+                         m.Paragraph("footer ", rmd.Superscript("bot")))
+
+    def test_fits_in_one(self):
+        markdown_str = self.tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+        self.assertEqual([markdown_str], self.tags.split_to_limit(10000, format_md=m.MarkdownFormats.reddit))
+
+    def test_list_is_split_between_items(self):
+        markdown_str = self.tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+        chunks = self.tags.split_to_limit(300, format_md=m.MarkdownFormats.reddit)
+        self.assertTrue(len(chunks) > 2)
+        self.assertTrue(all(len(chunk) <= 300 for chunk in chunks))
+        position = 0
+        for chunk in chunks:
+            if markdown_str.startswith("\n\n", position):
+                position += 2
+            self.assertTrue(markdown_str.startswith(chunk, position))
+            position += len(chunk)
+        self.assertEqual(len(markdown_str), position)
+        self.assertTrue(chunks[0].startswith("##Box office\n\nWeekend\n\n1. "))
+        for chunk in chunks[1:-1]:
+            self.assertRegex(chunk, r"^\d+\. Movie number ")
+
+    def test_blocks_are_packed_greedily(self):
+        tags = m.MD(*[m.Paragraph("x" * 40) for i in range(5)])
+        chunks = tags.split_to_limit(90, format_md=m.MarkdownFormats.reddit)
+        self.assertEqual(["x" * 40 + "\n\n" + "x" * 40] * 2 + ["x" * 40], chunks)
+
+    def test_block_too_large(self):
+        with self.assertRaises(ValueError):
+            m.MD(m.Paragraph("x" * 100)).split_to_limit(50, format_md=m.MarkdownFormats.reddit)
+
+
+class Test_RenderStats(unittest.TestCase):
+    def test_counts_every_node_class(self):
+        from markdown_tags.reddit_specific.movies_subreddit import Spoiler
+        tags = m.MD(m.Paragraph("a ", m.Bold("b"), rmd.Superscript("sup")),
+                    m.UnorderedList("x", m.UnorderedList("y")),
+                    m.Paragraph(Spoiler("visible", "hidden")))
+        stats = m.RenderStats()
+        markdown_str = tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit, stats=stats)
+        self.assertEqual(tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit), markdown_str)
+        self.assertEqual(2, stats[m.Paragraph].calls)
+        self.assertEqual(2, stats[m.UnorderedList].calls)
+        self.assertEqual(1, stats[rmd.Superscript].calls)
+        self.assertEqual(1, stats[Spoiler].calls)
+        self.assertEqual(len(markdown_str), sum(entry.chars for entry in stats.by_class.values()))
+        self.assertEqual(1, stats[Spoiler].validations)
+        for entry in stats.by_class.values():
+            self.assertTrue(entry.self_time <= entry.cumulative_time)
+
+    def test_markup_inside_measured_nodes(self):
+        # Superscript renders itself while being validated, the nodes in it
+        # are still counted on the first render.
+        tags = m.MD(m.Paragraph(rmd.Superscript(m.Bold("x"), m.Italic("y"))))
+        for i in range(2):
+            stats = m.RenderStats()
+            markdown_str = tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit, stats=stats)
+            self.assertEqual(1, stats[m.Bold].calls)
+            self.assertEqual(1, stats[m.Italic].calls)
+            self.assertEqual(len("^()"), stats[rmd.Superscript].chars)
+            self.assertEqual(len(markdown_str), sum(entry.chars for entry in stats.by_class.values()))
+
+    def test_consumer_time_is_not_counted(self):
+        ticks = [0]
+
+        def clock():
+            return ticks[0]
+
+        stats = m.RenderStats(clock=clock)
+        for chunk in m.MD(m.Paragraph(m.Bold("a"), m.Italic("b"))).iter_markdown(
+                recover=True, format_md=m.MarkdownFormats.reddit, stats=stats):
+            ticks[0] += 1
+        self.assertEqual(0, stats[m.MD].cumulative_time)
+        self.assertEqual(1, stats[m.Bold].calls)
+
+
+class Test_Parse(unittest.TestCase):
+    def assertRoundTrips(self, tags, format_md=m.MarkdownFormats.reddit):
+        markdown_str = tags.tags_to_markdown(recover=False, format_md=format_md, auto_escape=True)
+        parsed = m.parse(markdown_str, format_md)
+        self.assertEqual(markdown_str, parsed.tags_to_markdown(recover=False, format_md=format_md, auto_escape=True))
+
+    def test_round_trip(self):
+        self.assertRoundTrips(m.MD(m.Header(1, "Digest 1.0"),
+                                   m.Paragraph("a ", m.Bold("b*"), " c ", m.Italic("d_e"), " ",
+                                               m.Link("http://example.com/a_(b)", "link [1]", "title")),
+                                   m.Code("x = *1*\ny"),
+                                   m.HorizontalRuleLine(),
+                                   m.UnorderedList("x", "y"),
+                                   m.OrderedList("a", m.Bold("b")),
+                                   m.BlockQuote(m.Paragraph("quoted\ntext")),
+                                   m.Paragraph(rmd.Strikethrough("old"), rmd.Superscript("new (x)")),
+                                   m.Paragraph(m.Bold(m.Italic("both")), " and ", m.Bold(m.Italic("x"), " y"),
+                                               " ", m.Italic(m.Bold("z")))))
+        self.assertEqual(m.MD(m.Paragraph(m.Bold(m.Italic("x")))), m.parse("***x***", m.MarkdownFormats.reddit))
+        self.assertRoundTrips(m.MD(m.UnorderedList.with_title("Outline",
+                                                              m.OrderedList.with_title("Needs", "Air", "Water"),
+                                                              "Research")))
+
+    def test_inline(self):
+        (paragraph,) = m.parse("*em* **b** [l *x*](u_(a) \"t\") \\*lit\\* **open", m.MarkdownFormats.reddit).contents
+        (italic, space, bold, space, link, space, star, lit, end_star, rest) = paragraph.contents
+        self.assertEqual(("em",), italic.contents)
+        self.assertEqual(("b",), bold.contents)
+        self.assertEqual(("u_(a)", "t"), (link.url, link.title))
+        self.assertEqual("l ", link.contents[0])
+        self.assertIsInstance(link.contents[1], m.Italic)
+        self.assertEqual((m.Escaped("*"), "lit", m.Escaped("*")), (star, lit, end_star))
+        self.assertEqual(" **open", rest)
+
+    def test_text_round_trip(self):
+        # Text that isn't changed is written back as it was read.
+        for source in ["2\\*3 = 6 and 4\\*5", "call \\_init\\_ or \\[x\\](y)", "**b** and \\~~no strike~~",
+                       "+ a\\*b\n\n+ \\# c"]:
+            self.assertEqual(source, m.parse(source, m.MarkdownFormats.reddit).tags_to_markdown(
+                recover=False, format_md=m.MarkdownFormats.reddit).rstrip("\n"))
+        self.assertEqual("<p>2*3 = 6</p>", m.parse("2\\*3 = 6", m.MarkdownFormats.reddit).tags_to_html(
+            m.MarkdownFormats.reddit))
+
+    def test_reddit_nodes_only_in_reddit_format(self):
+        (paragraph,) = m.parse("~~s~~ 2^10", m.MarkdownFormats.reddit).contents
+        self.assertIsInstance(paragraph.contents[0], rmd.Strikethrough)
+        self.assertIsInstance(paragraph.contents[2], rmd.Superscript)
+        (paragraph,) = m.parse("~~s~~ 2^10", m.MarkdownFormats.basic).contents
+        self.assertEqual(("~~s~~ 2^10",), paragraph.contents)
+
+    def test_blocks(self):
+        tags = m.parse("Title\n=====\n\n> quote\n> more\n\n- a\n  - b\n- c\n\nafter\n\n    code\n\n***\n",
+                       m.MarkdownFormats.reddit)
+        (header, quote, unordered, paragraph, code, rule) = tags.contents
+        self.assertEqual((1, ("Title",)), (header.level, header.contents))
+        self.assertEqual(("quote\nmore",), quote.contents[0].contents)
+        self.assertEqual("a", unordered.contents[0].title)
+        self.assertEqual(("b",), unordered.contents[0].contents)
+        self.assertEqual(("code",), code.contents)
+        self.assertIs(m.HorizontalRuleLine(), rule)
+
+    def test_deep_input(self):
+        depth = 3 * sys.getrecursionlimit()
+        for (source, cls) in [("a" + "^" * depth + "b", rmd.Superscript), (">" * depth + "b", m.BlockQuote),
+                              ("+ " * depth + "b", m.UnorderedList)]:
+            node = m.parse(source, m.MarkdownFormats.reddit)
+            nested = 0
+            while not isinstance(node, str):
+                nested += isinstance(node, cls)
+                node = ([c for c in node.contents if not isinstance(c, str)] or ["b"])[0]
+            self.assertEqual(depth, nested)
+
+    def test_unmatched_delimiters_in_linear_time(self):
+        # None of the "***" closes anything, finding that out mustn't walk
+        # the open "[" every time.
+        def parse_time(n):
+            source = "[" * n + "a*** " * n
+            start = time.perf_counter()
+            m.parse(source, m.MarkdownFormats.reddit)
+            return time.perf_counter() - start
+        small = min(parse_time(2000) for i in range(3))
+        large = min(parse_time(16000) for i in range(3))
+        # 8 times the input, quadratic time would be 64 times as long.
+        self.assertLess(large, 24 * small)
+
+    def test_iter_parse_reads_lines(self):
+        blocks = m.iter_parse(io.StringIO("#Header\n\nparagraph\n"), m.MarkdownFormats.reddit)
+        self.assertIsInstance(next(blocks), m.Header)
+        self.assertIsInstance(next(blocks), m.Paragraph)
+
+
+class Test_DeepTrees(unittest.TestCase):
+    depth = 3 * sys.getrecursionlimit()
+
+    def test_deep_block_quotes(self):
+        tags = m.Paragraph("leaf")
+        for i in range(self.depth):
+            tags = m.BlockQuote(tags)
+        markdown_str = m.MD(tags).tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+        self.assertEqual(">" * self.depth + "leaf", markdown_str)
+        tags.freeze()
+        cache = m.RenderCache()
+        for i in range(2):
+            self.assertEqual(markdown_str, m.MD(tags).tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit,
+                                                                       cache=cache))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual([markdown_str] * 64, m.render_many([m.MD(tags)] * 64, m.MarkdownFormats.reddit,
+                                                            recover=False, workers=2))
+
+    def test_deep_lists(self):
+        # List output grows with the square of the depth, so not quite as deep.
+        tags = "leaf"
+        for i in range(sys.getrecursionlimit() + 200):
+            tags = (m.UnorderedList if i % 2 else m.OrderedList)(tags)
+        tags = m.MD(tags)
+        for incremental in (False, True):
+            chunks = tags.iter_markdown(recover=False, format_md=m.MarkdownFormats.reddit, incremental=incremental)
+            self.assertTrue(any("leaf" in chunk for chunk in chunks))
+
+    def test_deep_nesting_is_still_checked(self):
+        tags = m.Bold("leaf")
+        for i in range(self.depth):
+            tags = m.BlockQuote(tags)
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            m.MD(m.Paragraph(m.Bold(tags))).tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+
+
+class Test_LazyContents(unittest.TestCase):
+    def test_generators_and_callables(self):
+        tags = m.MD(m.UnorderedList("first", ("row " + str(i) for i in range(2))),
+                    m.OrderedList(lambda: (m.Bold(str(i)) for i in range(2))),
+                    (m.Paragraph(str(i)) for i in range(2)))
+        self.assertEqual(m.MD(m.UnorderedList("first", "row 0", "row 1"),
+                              m.OrderedList(m.Bold("0"), m.Bold("1")),
+                              m.Paragraph("0"), m.Paragraph("1")).tags_to_markdown(
+                                  recover=False, format_md=m.MarkdownFormats.reddit),
+                         tags.tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit))
+
+    def test_consumed_while_streaming(self):
+        taken = []
+
+        def rows():
+            for i in range(3):
+                taken.append(i)
+                yield "row " + str(i)
+
+        chunks = m.MD(m.UnorderedList(rows())).iter_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+        self.assertEqual([], taken)
+        self.assertEqual("+ ", next(chunks))
+        self.assertEqual([0], taken)
+
+    def test_items_are_checked_when_rendered(self):
+        tags = m.MD(m.Paragraph("a", lambda: [m.Paragraph("b")]))
+        chunks = tags.iter_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            list(chunks)
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            m.MD(lambda: ["not a block"]).tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+        self.assertEqual("ab", tags.tags_to_markdown(recover=True, format_md=m.MarkdownFormats.reddit))
+
+    def test_callables_are_called_on_every_render(self):
+        rows = [["a"]]
+        tags = m.MD(m.UnorderedList(lambda: rows[0]), m.Paragraph("footer")).freeze()
+        for recover in (False, True):
+            for options in (dict(cache=m.RenderCache()), dict(incremental=True)):
+                rows[0] = ["a"]
+                self.assertEqual("+ a\n\n\n\nfooter", tags.tags_to_markdown(recover, m.MarkdownFormats.reddit,
+                                                                            **options))
+                rows[0] = ["b", "c"]
+                self.assertEqual("+ b\n\n+ c\n\n\n\nfooter",
+                                 tags.tags_to_markdown(recover, m.MarkdownFormats.reddit, **options))
+
+
+class Test_Table(unittest.TestCase):
+    def test_rows_and_columns(self):
+        by_rows = m.Table(["Rank", "Movie"], [(1, "Avatar"), (2, "End|game")], align=["right"])
+        by_columns = m.Table.from_columns(["Rank", "Movie"], [array.array("i", [1, 2]), ["Avatar", "End|game"]],
+                                          align=["right"])
+        expected = "|Rank|Movie|\n|--:|---|\n|1|Avatar|\n|2|End\\|game|"
+        for table in (by_rows, by_columns):
+            self.assertEqual(expected, m.MD(table).tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit))
+
+    def test_cells_are_escaped(self):
+        table = m.Table(["a*"], [["x_y\nz"]])
+        self.assertEqual("|a\\*|\n|---|\n|x\\_y z|",
+                         m.MD(table).tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit,
+                                                      auto_escape=True))
+
+    def test_short_columns_are_padded(self):
+        table = m.Table.from_columns(["a", "b"], [[1, 2], [3]])
+        self.assertEqual("|a|b|\n|---|---|\n|1|3|\n|2||",
+                         m.MD(table).tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit))
+
+    def test_cells_of_any_type(self):
+        expected = "|2019|2020|\n|---|---|\n|1|2|"
+        for table in (m.Table([2019, 2020], [[1, 2]]), m.Table([2019, 2020], [[1, 2]]).freeze()):
+            self.assertEqual(expected, m.MD(table).tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit))
+        # Columns without a header get an empty one.
+        self.assertEqual("|a||\n|---|---|\n|1|2|",
+                         m.MD(m.Table(["a"], [[1, 2]])).tags_to_markdown(recover=True,
+                                                                         format_md=m.MarkdownFormats.reddit))
+
+    def test_streams_rows(self):
+        table = m.Table(["n"], ([i] for i in range(100)))
+        chunks = list(m.MD(table).iter_markdown(recover=False, format_md=m.MarkdownFormats.reddit))
+        self.assertTrue(len(chunks) > 100)
+
+    def test_reddit_rules(self):
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            m.MD(m.Table(["a"], [(1, 2)])).tags_to_markdown(recover=False, format_md=m.MarkdownFormats.basic)
+        # An empty header row is how reddit tables go without a visible header.
+        self.assertEqual("|||\n|---|---|\n|1|2|",
+                         m.MD(m.Table(["", ""], [(1, 2)])).tags_to_markdown(recover=False,
+                                                                           format_md=m.MarkdownFormats.reddit))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            m.MD(m.Table(["a"], [[1]], align=["left", "right"])).tags_to_markdown(
+                recover=False, format_md=m.MarkdownFormats.gfm)
+        wide = m.Table([str(i) for i in range(65)])
+        m.MD(wide).tags_to_markdown(recover=False, format_md=m.MarkdownFormats.basic)
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            m.MD(wide).tags_to_markdown(recover=False, format_md=m.MarkdownFormats.reddit)
+
+    def test_html(self):
+        html = pq(m.MD(m.Table(["a", "b"], [(1, "<x>")], align=[None, "center"])).tags_to_html(
+            format_md=m.MarkdownFormats.reddit), parser='html_fragments')
+        self.assertEqual(["a", "b"], [th.text() for th in html("th").items()])
+        self.assertEqual("<x>", html("td").eq(1).text())
+        self.assertEqual("center", html("td").eq(1).attr("align"))
+
+
+class Test_Imports(unittest.TestCase):
+    def test_subpackages_load_on_first_use(self):
+        code = ("import sys, markdown_tags as m; "
+                "loaded = 'markdown_tags.reddit_specific' in sys.modules; "
+                "m.reddit_specific.movies_subreddit.Spoiler; m.parse; "
+                "print(loaded, m.__version__)")
+        output = subprocess.check_output([sys.executable, "-c", code], universal_newlines=True,
+                                         cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+        self.assertEqual("False " + m.__version__, output.strip())
+
+
+class Test_TemplateBundle(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "replies.mdtb")
+        self.templates = {
+            "thanks": m.MD(m.Paragraph("Thanks ", m.Bold(m.Placeholder("user")), ", see ",
+                                       m.Link(m.Placeholder("url"), "the wiki"))).compile(m.MarkdownFormats.reddit),
+            "list": m.MD(m.UnorderedList(m.Placeholder("item"), "caf\u00e9")).compile(m.MarkdownFormats.reddit,
+                                                                                     auto_escape=False)}
+        m.write_template_bundle(self.path, self.templates)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_render_by_name(self):
+        with m.TemplateBundle(self.path) as bundle:
+            self.assertEqual(2, len(bundle))
+            self.assertEqual(["list", "thanks"], list(bundle.names()))
+            values = dict(user="some_user", url="http://example.com")
+            self.assertEqual(self.templates["thanks"].render(**values), bundle.render("thanks", **values))
+            self.assertEqual(self.templates["list"].render(item=m.Bold("a\nb")), bundle.render("list", item=m.Bold("a\nb")))
+            self.assertEqual(("item",), bundle["list"].names)
+            with self.assertRaises(m.IllegalMarkdownFormattingException):
+                bundle.render("thanks", user=m.Bold("user"), url="http://example.com")
+
+    def test_missing_template(self):
+        with m.TemplateBundle(self.path) as bundle:
+            self.assertFalse("other" in bundle)
+            with self.assertRaises(KeyError):
+                bundle.render("other")
+
+    def test_not_a_bundle(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a template bundle")
+        with self.assertRaises(ValueError):
+            m.TemplateBundle(self.path)
+
+
+class Test_Interning(unittest.TestCase):
+    def footer(self):
+        return m.Paragraph(rmd.Superscript("I am a bot"), " ", m.Link("http://example.com/modmail", "contact"))
+
+    def test_structural_equality(self):
+        self.assertEqual(self.footer(), self.footer())
+        self.assertEqual(hash(self.footer()), hash(self.footer()))
+        self.assertNotEqual(m.Bold("a"), m.Italic("a"))
+        self.assertNotEqual(m.Link("http://a", "a"), m.Link("http://b", "a"))
+        self.assertNotEqual(m.Bold("a"), "a")
+        self.assertEqual({self.footer(): 1}[self.footer()], 1)
+
+    def test_shares_equal_subtrees(self):
+        table = m.InternTable()
+        first = table.intern(m.MD(m.Paragraph("Hi ", m.Bold("a")), self.footer()))
+        second = table.intern(m.MD(m.Paragraph("Hi ", m.Bold("b")), self.footer()))
+        self.assertIs(first.contents[1], second.contents[1])
+        self.assertIsNot(first.contents[0], second.contents[0])
+        self.assertIs(first.contents[0].contents[0], second.contents[0].contents[0])
+        self.assertIsNot(first, second)
+        self.assertEqual("Hi **b**\n\n^(I am a bot) [contact](http://example.com/modmail)",
+                         second.tags_to_markdown(False, m.MarkdownFormats.reddit))
+
+    def test_lazy_contents_are_not_shared(self):
+        table = m.InternTable()
+        first = table.intern(m.UnorderedList(iter(["a"])))
+        second = table.intern(m.UnorderedList(iter(["a"])))
+        self.assertIsNot(first, second)
+        self.assertEqual(0, len(table))
+        self.assertEqual("+ a\n\n", m.MD(second).tags_to_markdown(False, m.MarkdownFormats.reddit))
+
+    def test_module_table(self):
+        self.assertIs(m.interned(m.Bold("shared")), m.interned(m.Bold("shared")))
+
+    def test_least_recently_used_are_forgotten(self):
+        table = m.InternTable(maxsize=2)
+        first = table.intern(m.Bold("a"))
+        for text in ["b", "c"]:
+            table.intern(m.Bold(text))
+        self.assertEqual(2, len(table))
+        self.assertIsNot(first, table.intern(m.Bold("a")))
+
+    def test_deep_trees(self):
+        def deep_quote():
+            tags = m.Paragraph("leaf")
+            for i in range(3 * sys.getrecursionlimit()):
+                tags = m.BlockQuote(tags)
+            return tags
+        self.assertEqual(deep_quote(), deep_quote())
+        self.assertEqual(hash(deep_quote()), hash(deep_quote()))
+        table = m.InternTable()
+        self.assertIs(table.intern(deep_quote()), table.intern(deep_quote()))
+
+
+class Test_Freeze(unittest.TestCase):
+    def tree(self):
+        return m.MD(m.Paragraph("Hi ", m.Bold("user"), " ", m.Link("http://example.com", "wiki")),
+                    m.UnorderedList.with_title("Rules", "be nice", m.UnorderedList("really")),
+                    m.Table(["a", "b"], [[1, 2]]))
+
+    def test_frozen_nodes_cant_change(self):
+        tags = self.tree().freeze()
+        self.assertTrue(tags.frozen and tags.contents[1].contents[1].frozen)
+        with self.assertRaises(AttributeError):
+            tags.contents[1].title = "Other rules"
+        with self.assertRaises(AttributeError):
+            tags.contents[0].contents[3].url = "http://example.org"
+        with self.assertRaises(AttributeError):
+            tags.append(m.Paragraph("more"))
+        self.assertFalse(self.tree().frozen)
+
+    def test_other_nodes_stay_unchanged(self):
+        frozen = m.Bold("a").freeze()
+        bold = m.Bold("a")
+        bold.contents = ("b",)
+        self.assertIsInstance(frozen, m.Bold)
+        self.assertNotEqual(frozen, bold)
+        self.assertEqual(frozen, m.Bold("a"))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            m.MD(m.Paragraph(m.Bold(frozen))).tags_to_markdown(False, m.MarkdownFormats.reddit)
+        copied = copy.copy(frozen)
+        copied.contents = ("c",)
+        self.assertFalse(copied.frozen)
+
+    def test_renders_like_unfrozen(self):
+        for format_md in (m.MarkdownFormats.basic, m.MarkdownFormats.reddit):
+            self.assertEqual(self.tree().tags_to_markdown(False, format_md),
+                             self.tree().freeze().tags_to_markdown(False, format_md))
+
+    def test_wrapped_objects_keep_their_text(self):
+        items = ["a"]
+        tags = m.MD(m.Paragraph(items)).freeze()
+        items.append("b")
+        self.assertEqual("['a']", tags.tags_to_markdown(False, m.MarkdownFormats.basic))
+
+    def test_iterator_contents_cant_be_frozen(self):
+        with self.assertRaises(ValueError):
+            m.MD(m.UnorderedList(iter(["a"]))).freeze()
+        tags = m.MD(m.UnorderedList(lambda: ["a"])).freeze()
+        self.assertEqual("+ a\n\n", tags.tags_to_markdown(False, m.MarkdownFormats.reddit))
+
+    def test_edit_copies_frozen_subtrees(self):
+        tags = m.MD(self.tree().contents[1].freeze())
+        tags.insert((0,), 0, "first")
+        self.assertFalse(tags.contents[0].frozen)
+        self.assertTrue(tags.contents[0].contents[2].frozen)
+        expected = m.MD(m.UnorderedList.with_title("Rules", "first", "be nice", m.UnorderedList("really")))
+        self.assertEqual(expected.tags_to_markdown(False, m.MarkdownFormats.reddit),
+                         tags.tags_to_markdown(False, m.MarkdownFormats.reddit))
+
+    def test_render_in_threads(self):
+        trees = [self.tree().freeze() for i in range(3)] * 20
+        expected = [t.tags_to_markdown(False, m.MarkdownFormats.reddit) for t in trees]
+        self.assertEqual(expected, m.render_many(trees, m.MarkdownFormats.reddit, False, workers=8, threads=True))
+        both = m.render_many(trees, [m.MarkdownFormats.basic, m.MarkdownFormats.reddit], False, workers=8,
+                             threads=True, ordered=False)
+        self.assertEqual(sorted((i, (trees[i].tags_to_markdown(False, m.MarkdownFormats.basic), expected[i]))
+                                for i in range(len(trees))), sorted(both))
+        with self.assertRaises(ValueError):
+            m.render_many([self.tree()], m.MarkdownFormats.reddit, False, threads=True)
+
+
+class Test_TextMetrics(unittest.TestCase):
+    def test_superscript_is_rendered_once(self):
+        renders = []
+
+        class CountedBold(m.Bold):
+            __slots__ = ()
+
+            def _iter_markdown(self, opt_ctx):
+                renders.append(self)
+                return super(CountedBold, self)._iter_markdown(opt_ctx)
+
+        tags = m.MD(m.Paragraph(rmd.Superscript(*[CountedBold("word") for i in range(100)])))
+        markdown_str = tags.tags_to_markdown(False, m.MarkdownFormats.reddit)
+        self.assertEqual("^(" + "**word**" * 100 + ")", markdown_str)
+        self.assertEqual(100, len(renders))
+        self.assertEqual(markdown_str, tags.tags_to_markdown(False, m.MarkdownFormats.reddit))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            m.MD(m.Paragraph(rmd.Superscript(m.Bold("a\nb")))).tags_to_markdown(False, m.MarkdownFormats.reddit)
+
+    def test_metrics(self):
+        metrics = m.BlockQuote("a", m.Bold(m.Italic("b\nc"))).metrics(m.MarkdownFormats.reddit)
+        self.assertEqual((12, True, True, 3), (metrics.length, metrics.newline, metrics.block, metrics.depth))
+        link = m.Link("http://example.com", "link")
+        self.assertIs(link.metrics(m.MarkdownFormats.reddit), link.metrics(m.MarkdownFormats.reddit))
+        self.assertEqual(8, m.Bold("a*b").metrics(m.MarkdownFormats.reddit, auto_escape=True).length)
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            m.Bold(m.Bold("b")).metrics(m.MarkdownFormats.reddit)
+
+    def test_measured_text_is_taken_once(self):
+        link = m.Link("http://example.com", "link")
+        opt_ctx = m.markdown_tags._MDTagsContext(recover=False, format_md=m.MarkdownFormats.reddit)
+        opt_ctx.metrics(link)
+        self.assertEqual("[link](http://example.com)", opt_ctx.take_measured(link))
+        self.assertIsNone(opt_ctx.take_measured(link))
+        # The text stays with the render that measured it, not on the node.
+        opt_ctx = m.markdown_tags._MDTagsContext(recover=False, format_md=m.MarkdownFormats.reddit)
+        opt_ctx.metrics(link)
+        self.assertIsNone(opt_ctx.take_measured(link))
+
+    def test_lazy_contents(self):
+        with self.assertRaises(ValueError):
+            m.UnorderedList(iter(["a"])).metrics(m.MarkdownFormats.reddit)
+        items = m.UnorderedList(lambda: ["a"])
+        self.assertEqual(5, items.metrics(m.MarkdownFormats.reddit).length)
+        opt_ctx = m.markdown_tags._MDTagsContext(recover=False, format_md=m.MarkdownFormats.reddit)
+        opt_ctx.metrics(items)
+        self.assertIsNone(opt_ctx.take_measured(items))
+
+
+class Test_Dialects(unittest.TestCase):
+    def render(self, format_md, *blocks):
+        return m.MD(*blocks).tags_to_markdown(False, format_md)
+
+    def test_format_rules(self):
+        table = m.Table(["a"], [["1"]])
+        self.assertEqual("|a|\n|---|\n|1|", self.render(m.MarkdownFormats.gfm, table))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.render(m.MarkdownFormats.commonmark, table)
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.render(m.MarkdownFormats.new_reddit, m.Table([str(i) for i in range(65)]))
+        self.assertEqual("~~a~~", self.render(m.MarkdownFormats.gfm, m.Paragraph(rmd.Strikethrough("a"))))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.render(m.MarkdownFormats.commonmark, m.Paragraph(rmd.Strikethrough("a")))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.render(m.MarkdownFormats.gfm, m.Paragraph(rmd.Superscript("a")))
+        self.assertEqual("^(a)", self.render(m.MarkdownFormats.new_reddit, m.Paragraph(rmd.Superscript("a"))))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.render(m.MarkdownFormats.new_reddit, m.Paragraph(m.Image("http://example.com/a.png", "a")))
+
+    def test_spoiler_on_new_reddit(self):
+        from markdown_tags.reddit_specific.movies_subreddit import Spoiler
+        spoiler = m.Paragraph(Spoiler("Ending", "they win"))
+        self.assertEqual('[Ending](#s "they win")', self.render(m.MarkdownFormats.reddit, spoiler))
+        self.assertEqual("Ending >!they win!<", self.render(m.MarkdownFormats.new_reddit, spoiler))
+
+    def test_register_emitter_and_validator(self):
+        class Mention(m.MarkdownFormattingObject):
+            __slots__ = ()
+
+            def _iter_markdown(self, opt_ctx):
+                yield "@"
+                yield self.contents
+
+        class TeamMention(Mention):
+            __slots__ = ()
+
+        def no_admins(node, opt_ctx):
+            if "admin" in node.contents:
+                raise m.IllegalMarkdownFormattingException("Don't mention the admins")
+
+        dialect = m.get_dialect(m.MarkdownFormats.gfm)
+        dialect.register_emitter(Mention, lambda node, opt_ctx: ("**@", node.contents, "**"))
+        dialect.register_validator(Mention, no_admins)
+        self.addCleanup(dialect.unregister, Mention)
+        self.assertEqual("@me", self.render(m.MarkdownFormats.basic, m.Paragraph(Mention("me"))))
+        self.assertEqual("**@me**", self.render(m.MarkdownFormats.gfm, m.Paragraph(Mention("me"))))
+        self.assertEqual("**@team**", self.render(m.MarkdownFormats.gfm, m.Paragraph(TeamMention("team"))))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.render(m.MarkdownFormats.gfm, m.Paragraph(TeamMention("admin")))
+        self.render(m.MarkdownFormats.basic, m.Paragraph(TeamMention("admin")))
+        dialect.unregister(Mention)
+        self.assertEqual("@admin", self.render(m.MarkdownFormats.gfm, m.Paragraph(TeamMention("admin"))))
+
+
+class Test_BytesOutput(unittest.TestCase):
+    def setUp(self):
+        self.tags = m.MD(*[m.Paragraph("caf\u00e9 ", m.Bold(str(i)), " \u2192 ", m.Link("http://example.com", "w"))
+                           for i in range(2000)])
+        self.markdown_bytes = self.tags.tags_to_markdown(False, m.MarkdownFormats.reddit).encode("utf-8")
+
+    def test_tags_to_bytes(self):
+        self.assertEqual(self.markdown_bytes, self.tags.tags_to_bytes(False, m.MarkdownFormats.reddit))
+
+    def test_render_into(self):
+        buffer = bytearray(len(self.markdown_bytes) + 4)
+        written = self.tags.render_into(memoryview(buffer), False, m.MarkdownFormats.reddit, offset=4)
+        self.assertEqual(len(self.markdown_bytes), written)
+        self.assertEqual(self.markdown_bytes, bytes(buffer[4:]))
+        buffer.append(0)
+
+    def test_buffer_too_small(self):
+        with self.assertRaises(ValueError) as raised:
+            self.tags.render_into(bytearray(100), False, m.MarkdownFormats.reddit)
+        self.assertIn(str(len(self.markdown_bytes)), str(raised.exception))
+        # Nothing is written unless all of it fits.
+        buffer = bytearray(b"x" * (len(self.markdown_bytes) - 1))
+        with self.assertRaises(ValueError):
+            self.tags.render_into(buffer, False, m.MarkdownFormats.reddit)
+        self.assertEqual(b"x" * (len(self.markdown_bytes) - 1), buffer)
+
+
+class Test_CompactOutput(unittest.TestCase):
+    def test_same_structure_in_every_format(self):
+        tags = compact_corpus()
+        for format_md in m.MarkdownFormats:
+            default = tags.tags_to_markdown(False, format_md)
+            compact = tags.tags_to_markdown(False, format_md, compact=True)
+            self.assertLess(len(compact), len(default))
+            parsed = m.parse(compact, format_md)
+            self.assertEqual(m.parse(default, format_md), parsed)
+            # Read back as what was written, not misread the same way twice.
+            self.assertEqual(tags.contents[1], parsed.contents[1])
+            self.assertEqual(tags.contents[5], parsed.contents[5])
+
+    def test_compact_markup(self):
+        tags = m.MD(m.OrderedList("a", m.UnorderedList("b", "c")), m.HorizontalRuleLine(),
+                    m.BlockQuote(m.UnorderedList("d", "e")))
+        self.assertEqual("1. a\n\n1. + b\n\n    + c\n\n---\n\n>+ d\n>\n>+ e",
+                         tags.tags_to_markdown(False, m.MarkdownFormats.reddit, compact=True))
+
+    def test_split_to_limit_numbers_parts(self):
+        tags = m.MD(m.OrderedList(*["item %d" % i for i in range(1, 11)]))
+        chunks = tags.split_to_limit(40, m.MarkdownFormats.reddit, compact=True)
+        self.assertTrue(len(chunks) > 1 and all(len(chunk) <= 40 for chunk in chunks))
+        # A later string starts with the item's own number.
+        number = re.match(r"(\d+)\. item \1\b", chunks[1]).group(1)
+        self.assertNotEqual("1", number)
+
+    def test_kept_output_is_per_mode(self):
+        tags = m.MD(m.UnorderedList("a", "b"))
+        default = tags.tags_to_markdown(False, m.MarkdownFormats.reddit, incremental=True)
+        compact = tags.tags_to_markdown(False, m.MarkdownFormats.reddit, incremental=True, compact=True)
+        self.assertEqual(("+ a\n\n+ b\n\n", "+ a\n\n+ b"), (default, compact))
+
+
+class Test_HtmlBackend(unittest.TestCase):
+    def html(self, tags, format_md=m.MarkdownFormats.reddit):
+        return pq(tags.tags_to_html(format_md=format_md), parser='html_fragments')
+
+    def test_paragraphs(self):
+        html = self.html(m.MD(m.Paragraph(m.Italic("Italian")), m.Paragraph(m.Bold("Boring, Portland"))))
+        paragraphs = html("p")
+        self.assertEqual(2, len(paragraphs))
+        self.assertEqual("Italian", paragraphs[0].find("em").text)
+        self.assertEqual("Boring, Portland", paragraphs[1].find("strong").text)
+
+    def test_nested_lists(self):
+        html = self.html(m.MD(m.UnorderedList.with_title("Outline",
+                                                         m.OrderedList.with_title("Needs",
+                                                                                  m.UnorderedList("Air", "Water")),
+                                                         "Research")))
+        self.assertEqual(2, len(html("ul")))
+        self.assertEqual(1, len(html("ol")))
+        self.assertEqual(["Air", "Water"], [i.text() for i in html("ol ul li").items()])
+
+    def test_text_and_attributes_are_escaped(self):
+        html_str = m.MD(m.Paragraph("a < b & ", m.Link('http://example.com/?q="x"', "<tag>"))).tags_to_html(
+            format_md=m.MarkdownFormats.reddit)
+        self.assertEqual('<p>a &lt; b &amp; <a href="http://example.com/?q=&quot;x&quot;">&lt;tag&gt;</a></p>',
+                         html_str)
+
+    def test_blocks(self):
+        html = self.html(m.MD(m.Header(2, "Title"), m.BlockQuote("quoted"), m.Code("x = 1"), m.HorizontalRuleLine()))
+        self.assertEqual("Title", html("h2").text())
+        self.assertEqual("quoted", html("blockquote p").text())
+        self.assertEqual("x = 1", html("pre code").text())
+        self.assertEqual(1, len(html("hr")))
+
+    def test_reddit_nodes(self):
+        html = self.html(m.MD(m.Paragraph("5", rmd.Superscript("2"), rmd.Strikethrough("colour"))))
+        self.assertEqual("2", html("sup").text())
+        self.assertEqual("colour", html("del").text())
+
+    def test_image(self):
+        img = self.html(m.MD(m.Paragraph(m.Image("./pic1", "pic 1"))), m.MarkdownFormats.basic)("img")
+        self.assertEqual("./pic1", img.attr("src"))
+        self.assertEqual("pic 1", img.attr("alt"))
+        with self.assertRaises(m.IllegalMarkdownFormattingException):
+            self.html(m.MD(m.Paragraph(m.Image("./pic1", "pic 1"))))
+
+
 if __name__ == "__main__":
     download_markdown_if_needed()
     unittest.main()
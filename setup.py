@@ -1,10 +1,13 @@
 import os.path
+import re
 
 from setuptools import setup, find_packages
 
 
-__version__ = open(os.path.join(os.path.dirname(__file__),
-                                "markdown_tags/VERSION")).read().strip()
+# Read without importing the package, markdown_tags/_version.py is the only
+# place the version is kept.
+__version__ = re.search(r'__version__ = "([^"]+)"',
+                        open(os.path.join(os.path.dirname(__file__), "markdown_tags/_version.py")).read()).group(1)
 
 setup(name='markdown_tags',
       version=__version__,